@@ -0,0 +1,109 @@
+import os
+import re
+import time
+import string
+from config import Config
+from cache import TTLCache
+
+USAGE = (
+    "Usage: /batch <template> [| <regex>]\n"
+    "Fields: {n} position in the batch, {name} original name without extension, "
+    "{0}, {1}… or {group} captures of the regex on the original file name.\n"
+    "Example: /batch Show S01E{0:02d} | [Ee](\\d+)"
+)
+
+MAX_NAME = 128   # characters in a new file name, extension included
+MAX_WIDTH = 16   # largest width/precision a template field may ask for
+
+class Batch:
+    """Files a user is collecting for one batch rename, in arrival order."""
+
+    def __init__(self, template, pattern=None):
+        self.template = template
+        self.pattern = pattern
+        self.files = []
+        self.status_msg = None
+        self._next_edit = 0.0
+
+    def add(self, message):
+        self.files.append(message)
+        return len(self.files)
+
+    def due_edit(self):
+        """True at most once per PROGRESS_INTERVAL, to keep the collecting message from flooding edits."""
+        now = time.monotonic()
+        if now < self._next_edit:
+            return False
+        self._next_edit = now + Config.PROGRESS_INTERVAL
+        return True
+
+    def names(self):
+        """New file names in order. Raises ValueError naming the first file the template cannot handle."""
+        out = []
+        for n, msg in enumerate(sorted(self.files, key=lambda m: m.id), start=1):
+            media = msg.document or msg.video or msg.audio or msg.photo
+            # photos have no file name; they are sent on as jpeg files
+            out.append(make_name(self.template, self.pattern, n, getattr(media, "file_name", None) or ("photo.jpg" if msg.photo else "")))
+        return out
+
+# user_id -> Batch being collected
+_open = TTLCache(10000, Config.BATCH_COLLECT_TTL)
+
+def parse(arg):
+    """Batch from the /batch argument "template [| regex]". Raises ValueError with a message for the user."""
+    template, _, regex = arg.partition("|")
+    template, regex = template.strip(), regex.strip()
+    if not template:
+        raise ValueError(USAGE)
+    check_template(template)
+    try:
+        pattern = re.compile(regex) if regex else None
+    except re.error as e:
+        raise ValueError(f"Bad regex: {e}")
+    return Batch(template, pattern)
+
+def check_template(template):
+    """Only plain fields with small widths: a spec like {n:0200000000} would build a 200 MB name."""
+    try:
+        fields = list(string.Formatter().parse(template))
+    except ValueError as e:
+        raise ValueError(f"Bad template: {e}")
+    for _, field, spec, _ in fields:
+        if field is None:
+            continue
+        if not re.fullmatch(r"\w*", field):
+            raise ValueError(f"Bad template field {{{field}}}: use {{n}}, {{name}}, {{0}} or a group name")
+        if "{" in spec or any(int(w) > MAX_WIDTH for w in re.findall(r"\d+", spec)):
+            raise ValueError(f"Bad format spec {{{field}:{spec}}}: widths go up to {MAX_WIDTH}")
+
+def make_name(template, pattern, n, file_name):
+    check_template(template)
+    stem, ext = os.path.splitext(file_name)
+    groups, named = (), {}
+    if pattern:
+        m = pattern.search(file_name)
+        if m is None:
+            raise ValueError(f"The regex does not match {file_name!r}")
+        # numeric captures become ints so {0:02d} works; optional groups that did not match are ""
+        groups = tuple(int(g) if g and g.isdigit() else g or "" for g in m.groups())
+        named = {k: int(v) if v and v.isdigit() else v or "" for k, v in m.groupdict().items()}
+    try:
+        name = template.format(*groups, **{"name": stem, **named, "n": n})
+    except (KeyError, IndexError, ValueError, TypeError) as e:
+        raise ValueError(f"Template does not fit {file_name!r}: {e}")
+    name = name.strip().replace("/", "_")
+    if ext and not name.lower().endswith(ext.lower()):
+        name += ext
+    if len(name) > MAX_NAME:
+        ext = ext if len(ext) <= MAX_WIDTH else ""
+        name = name[:MAX_NAME - len(ext)] + ext
+    return name
+
+def start(user_id, batch):
+    _open.set(user_id, batch)
+
+def get(user_id):
+    return _open.get(user_id)
+
+def pop(user_id):
+    return _open.pop(user_id)
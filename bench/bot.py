@@ -0,0 +1,145 @@
+"""
+End-to-end throughput benchmark: N simulated users push rename/split/
+compress jobs through text_reply with a fake Telegram client and an
+in-memory Mongo; an in-process worker claims and runs them.
+
+    python -m bench.bot --users 20 --jobs 3 --size-mb 50
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import collections
+import tempfile
+
+def parse_args():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--users", type=int, default=10)
+    p.add_argument("--jobs", type=int, default=3, help="jobs per user")
+    p.add_argument("--size-mb", type=float, default=20, help="synthetic file size")
+    p.add_argument("--ops", default="rename,split,compress", help="comma separated mix of operations")
+    p.add_argument("--split-mb", type=int, default=8)
+    p.add_argument("--bandwidth-mb", type=float, default=100, help="simulated Telegram bandwidth, MiB/s")
+    p.add_argument("--latency", type=float, default=0.05, help="simulated Telegram API latency, seconds")
+    p.add_argument("--db-latency", type=float, default=0.005, help="simulated Mongo round trip, seconds")
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--per-user", type=int, default=1)
+    p.add_argument("--parallel-min-mb", type=int, default=64, help="size from which downloads use parallel ranges")
+    p.add_argument("--no-stream", action="store_true", help="renames download to TMP_DIR first instead of streaming")
+    p.add_argument("--seed", type=int, default=1)
+    return p.parse_args()
+
+def configure(args, tmp):
+    # must happen before the bot modules read Config
+    os.environ.update({
+        "MONGO_URI": "mongodb://localhost:27017",
+        "TMP_DIR": os.path.join(tmp, "downloads"),
+        "THUMB_DIR": os.path.join(tmp, "thumbs"),
+        "SPLIT_SIZE_MB": str(args.split_mb),
+        "MAX_UPLOAD_MB": str(args.split_mb),
+        "JOB_WORKERS": str(args.workers),
+        "JOB_PER_USER": str(args.per_user),
+        "DEFAULT_DAILY_LIMIT": str(args.jobs * 10),
+        "SHORTENER_API": "",
+        "USE_NSFW": "false",
+        "METRICS_PORT": "0",
+        "PROGRESS_INTERVAL": "1",
+        "PARALLEL_MIN_MB": str(args.parallel_min_mb),
+        "STREAM_RENAME": "false" if args.no_stream else "true",
+    })
+
+def install_fakes(args):
+    import database, results, nsfw, broadcast, transfer, jobqueue, main
+    from bench.fakes import FakeClient, FakeCollection
+    cols = {}
+    for name in ("users", "logs", "transfers", "broadcasts", "nsfw_verdicts", "job_results", "jobs"):
+        cols[name] = FakeCollection(name, latency=args.db_latency)
+        setattr(database, name, cols[name])
+    database.log_sink.collection = cols["logs"]
+    database.transfer_sink.collection = cols["transfers"]
+    results.results = cols["job_results"]
+    nsfw.nsfw_verdicts = cols["nsfw_verdicts"]
+    broadcast.users = cols["users"]
+    broadcast.broadcasts = cols["broadcasts"]
+    jobqueue.jobs = cols["jobs"]
+    client = FakeClient(bandwidth=args.bandwidth_mb * 1024 * 1024, latency=args.latency)
+    main.app = client
+    transfer._send_uploaded = lambda c, *a, **kw: c.send_uploaded(*a, **kw)
+    transfer._upload_session = lambda c: c.upload_session()
+    return main, client, cols
+
+async def run(args, tmp):
+    main, client, cols = install_fakes(args)
+    from bench.fakes import fake_file_message, FakeMessage, peak_rss_mb, dir_size, percentile
+    rnd = random.Random(args.seed)
+    ops = args.ops.split(",")
+    size = int(args.size_mb * 1024 * 1024)
+    main.ensure_dirs()
+    await main.jobqueue.ensure_indexes()
+
+    started, finished = {}, {}
+    real_run_job = main.jobs.run_job
+
+    async def timed_run_job(client, job):
+        try:
+            return await real_run_job(client, job)
+        finally:
+            finished[job.key] = time.perf_counter()
+    main.jobs.run_job = timed_run_job
+    worker = main.Worker(client)
+    await worker.start()
+
+    peak_disk = 0
+    async def watch_disk():
+        nonlocal peak_disk
+        while True:
+            peak_disk = max(peak_disk, dir_size(main.Config.TMP_DIR))
+            await asyncio.sleep(0.05)
+    watcher = asyncio.create_task(watch_disk())
+
+    async def user(uid):
+        for _ in range(args.jobs):
+            op = rnd.choice(ops)
+            file_msg = fake_file_message(client, uid, uid, size)
+            text = {"rename": f"renamed_{file_msg.id}", "split": "split", "compress": "compress"}[op]
+            msg = FakeMessage(client, uid, uid, text=text, reply_to=file_msg)
+            started[main.jobqueue.job_key(uid, file_msg.id)] = time.perf_counter()
+            await main.text_reply(client, msg)
+            await asyncio.sleep(rnd.random() * 0.05)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(user(1000 + i) for i in range(args.users)))
+    while len(finished) < len(started) or any(d["status"] in ("queued", "running") for d in cols["jobs"].docs.values()):
+        await asyncio.sleep(0.05)
+    wall = time.perf_counter() - t0
+    watcher.cancel()
+    await worker.stop()
+    await main.close_db()
+
+    lat = [finished[k] - started[k] for k in started]
+    own, children = peak_rss_mb()
+    total_jobs = len(started)
+    print(f"jobs:           {total_jobs} ({args.users} users x {args.jobs}, ops={args.ops}, {args.size_mb} MiB each)")
+    print(f"wall time:      {wall:.2f}s")
+    print(f"throughput:     {total_jobs / wall:.2f} jobs/s")
+    print(f"latency p50:    {percentile(lat, 50):.2f}s")
+    print(f"latency p99:    {percentile(lat, 99):.2f}s")
+    print(f"peak RSS:       {own:.1f} MiB (children {children:.1f} MiB)")
+    print(f"peak TMP_DIR:   {peak_disk / 1024 / 1024:.1f} MiB")
+    print(f"bytes down/up:  {client.bytes_down / 1024 / 1024:.1f} / {client.bytes_up / 1024 / 1024:.1f} MiB")
+    print(f"status edits:   {client.edits}")
+    print(f"mongo calls:    " + ", ".join(f"{n}={c.calls}" for n, c in cols.items() if c.calls))
+    print(f"user cache:     {main.cache_stats()}")
+    print(f"job states:     " + ", ".join(f"{s}={n}" for s, n in sorted(collections.Counter(d["status"] for d in cols["jobs"].docs.values()).items())))
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory(prefix="renamebench") as tmp:
+        configure(args, tmp)
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        asyncio.run(run(args, tmp))
+
+if __name__ == "__main__":
+    main()
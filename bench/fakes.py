@@ -0,0 +1,528 @@
+"""
+Offline stand-ins used by the benchmarks: an in-memory Mongo collection
+that understands the queries database.py issues, and a Pyrogram-like
+client that simulates transfer latency and bandwidth.
+"""
+import io
+import os
+import copy
+import time
+import asyncio
+import itertools
+from types import SimpleNamespace
+from pymongo.errors import DuplicateKeyError
+
+# ---- Mongo ----
+
+_MISSING = object()
+
+def _get(doc, path):
+    for part in path.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return _MISSING
+        doc = doc[part]
+    return doc
+
+def _parent(doc, path):
+    """The dict holding the last part of a dotted path (created as needed), and that part."""
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.setdefault(part, {})
+    return doc, last
+
+def _expr(e, doc):
+    """Evaluate the subset of aggregation expressions used in database.py."""
+    if isinstance(e, str) and e.startswith("$"):
+        v = _get(doc, e[1:])
+        return None if v is _MISSING else v
+    if isinstance(e, list):
+        return [_expr(x, doc) for x in e]
+    if not isinstance(e, dict):
+        return e
+    (op, args), = e.items()
+    a = [_expr(x, doc) for x in args] if isinstance(args, list) else _expr(args, doc)
+    if op == "$ifNull":
+        return a[0] if a[0] is not None else a[1]
+    if op == "$cond":
+        return a[1] if a[0] else a[2]
+    if op == "$add":
+        return sum(a)
+    if op == "$subtract":
+        return a[0] - a[1]
+    if op == "$max":
+        return max(x for x in a if x is not None)
+    if op == "$or":
+        return any(a)
+    if op == "$and":
+        return all(a)
+    if op in ("$lt", "$lte", "$gt", "$gte", "$eq", "$ne"):
+        return _compare(op, a[0], a[1])
+    raise NotImplementedError(op)
+
+def _compare(op, x, y):
+    if op == "$eq":
+        return x == y
+    if op == "$ne":
+        return x != y
+    if x is None or y is None:
+        # Mongo orders null below everything
+        x, y = (x is not None, x), (y is not None, y)
+        if not x[0] or not y[0]:
+            x, y = x[0], y[0]
+        else:
+            x, y = x[1], y[1]
+    return {"$lt": x < y, "$lte": x <= y, "$gt": x > y, "$gte": x >= y}[op]
+
+def matches(doc, query):
+    for key, cond in query.items():
+        if key == "$or":
+            if not any(matches(doc, q) for q in cond):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, q) for q in cond):
+                return False
+        elif key == "$expr":
+            if not _expr(cond, doc):
+                return False
+        else:
+            v = _get(doc, key)
+            if isinstance(cond, dict) and cond and all(k.startswith("$") for k in cond):
+                for op, arg in cond.items():
+                    if op == "$in":
+                        if v not in arg:
+                            return False
+                    elif op == "$nin":
+                        if v in arg:
+                            return False
+                    elif op == "$exists":
+                        if (v is not _MISSING) != bool(arg):
+                            return False
+                    elif v is _MISSING or not _compare(op, v, arg):
+                        return False
+            elif v is _MISSING or v != cond:
+                return False
+    return True
+
+def apply_update(doc, update, inserting=False):
+    if isinstance(update, list):
+        for stage in update:
+            (op, fields), = stage.items()
+            computed = {k: _expr(v, doc) for k, v in fields.items()}
+            doc.update(computed)
+        return
+    for op, fields in update.items():
+        for path, value in fields.items():
+            target, key = _parent(doc, path)
+            if op == "$set" or (op == "$setOnInsert" and inserting):
+                target[key] = copy.deepcopy(value)
+            elif op == "$inc":
+                target[key] = target.get(key, 0) + value
+            elif op == "$push":
+                lst = target.setdefault(key, [])
+                if isinstance(value, dict) and "$each" in value:
+                    lst.extend(value["$each"])
+                    if "$slice" in value:
+                        lst[:] = lst[value["$slice"]:] if value["$slice"] < 0 else lst[:value["$slice"]]
+                else:
+                    lst.append(value)
+            elif op == "$unset":
+                target.pop(key, None)
+
+class FakeCursor:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def sort(self, key, direction=1):
+        if isinstance(key, list):
+            for k, d in reversed(key):
+                self._docs.sort(key=lambda x: x.get(k), reverse=d < 0)
+        else:
+            self._docs.sort(key=lambda x: x.get(key), reverse=direction < 0)
+        return self
+
+    def limit(self, n):
+        if n:
+            self._docs = self._docs[:n]
+        return self
+
+    async def to_list(self, length=None):
+        return self._docs[:length] if length else list(self._docs)
+
+    def __aiter__(self):
+        self._it = iter(self._docs)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._it)
+        except StopIteration:
+            raise StopAsyncIteration
+
+class FakeCollection:
+    """
+    In-memory replacement for a motor collection. `latency` seconds are
+    awaited per call to model the network round trip to Atlas.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, name, latency=0.0):
+        self.name = name
+        self.latency = latency
+        self.docs = {}
+        self.calls = 0
+        self.unique = set()  # fields with a unique (sparse) index
+
+    def _check_unique(self, doc):
+        for field in self.unique:
+            v = _get(doc, field)
+            if v is not _MISSING and any(o is not doc and _get(o, field) == v for o in self.docs.values()):
+                raise DuplicateKeyError(f"E11000 duplicate key {field}: {v!r}")
+
+    def _apply(self, doc, update):
+        before = copy.deepcopy(doc)
+        apply_update(doc, update)
+        try:
+            self._check_unique(doc)
+        except DuplicateKeyError:
+            doc.clear()
+            doc.update(before)
+            raise
+
+    async def _rtt(self):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _find(self, query):
+        if "_id" in query and not isinstance(query["_id"], dict):
+            d = self.docs.get(query["_id"])
+            return [d] if d is not None and matches(d, query) else []
+        return [d for d in self.docs.values() if matches(d, query)]
+
+    def _project(self, doc, projection):
+        if not projection:
+            return copy.deepcopy(doc)
+        return {k: copy.deepcopy(v) for k, v in doc.items() if k == "_id" or projection.get(k)}
+
+    async def find_one(self, query=None, projection=None, sort=None):
+        await self._rtt()
+        found = self._find(query or {})
+        if sort:
+            found = FakeCursor(found).sort(sort)._docs
+        return self._project(found[0], projection) if found else None
+
+    def find(self, query=None, projection=None):
+        self.calls += 1
+        return FakeCursor([self._project(d, projection) for d in self._find(query or {})])
+
+    async def insert_one(self, doc):
+        await self._rtt()
+        doc.setdefault("_id", next(self._ids))
+        self.docs[doc["_id"]] = copy.deepcopy(doc)
+        return SimpleNamespace(inserted_id=doc["_id"])
+
+    async def insert_many(self, docs, ordered=True):
+        await self._rtt()
+        for doc in docs:
+            doc.setdefault("_id", next(self._ids))
+            self.docs[doc["_id"]] = copy.deepcopy(doc)
+
+    def _upsert(self, query, update):
+        doc = {k: v for k, v in query.items() if not k.startswith("$") and not isinstance(v, dict)}
+        doc.setdefault("_id", next(self._ids))
+        apply_update(doc, update, inserting=True)
+        self._check_unique(doc)
+        self.docs[doc["_id"]] = doc
+        return doc
+
+    async def update_one(self, query, update, upsert=False):
+        await self._rtt()
+        found = self._find(query)
+        if found:
+            self._apply(found[0], update)
+        elif upsert:
+            self._upsert(query, update)
+        return SimpleNamespace(matched_count=len(found[:1]))
+
+    async def update_many(self, query, update):
+        await self._rtt()
+        found = self._find(query)
+        for d in found:
+            self._apply(d, update)
+        return SimpleNamespace(matched_count=len(found))
+
+    async def find_one_and_update(self, query, update, upsert=False, return_document=False, sort=None, projection=None):
+        await self._rtt()
+        found = self._find(query)
+        if sort:
+            found = FakeCursor(found).sort(sort)._docs
+        if not found:
+            if not upsert:
+                return None
+            doc = self._upsert(query, update)
+            return copy.deepcopy(doc) if return_document else None
+        before = copy.deepcopy(found[0])
+        self._apply(found[0], update)
+        return copy.deepcopy(found[0]) if return_document else before
+
+    async def delete_one(self, query):
+        await self._rtt()
+        found = self._find(query)
+        if found:
+            del self.docs[found[0]["_id"]]
+
+    async def delete_many(self, query):
+        await self._rtt()
+        for d in self._find(query):
+            del self.docs[d["_id"]]
+
+    async def count_documents(self, query):
+        await self._rtt()
+        return len(self._find(query))
+
+    async def create_index(self, keys, unique=False, **kwargs):
+        if unique and isinstance(keys, str):
+            self.unique.add(keys)
+
+# ---- Telegram ----
+
+class FakeMessage:
+    _ids = itertools.count(1000)
+
+    def __init__(self, client, chat_id, user_id, text=None, reply_to=None, media=None, caption=None):
+        self._client = client
+        self.id = next(self._ids)
+        self.chat = SimpleNamespace(id=chat_id)
+        self.from_user = SimpleNamespace(id=user_id)
+        self.text = text
+        self.caption = caption
+        self.reply_to_message = reply_to
+        self.document = media
+        self.video = self.audio = self.photo = None
+        self.media_group_id = None
+        self.empty = False
+        client.messages[(chat_id, self.id)] = self
+
+    async def reply_text(self, text, **kwargs):
+        return await self._client.send_message(self.chat.id, text)
+
+    async def edit(self, text, **kwargs):
+        self._client.edits += 1
+        self.text = text
+        return self
+
+    edit_text = edit
+
+    async def delete(self):
+        pass
+
+class FakeUploadSession:
+    def __init__(self, client):
+        self.client = client
+
+    async def invoke(self, rpc):
+        await asyncio.sleep(len(rpc.bytes) / self.client.bandwidth)
+        self.client.bytes_up += len(rpc.bytes)
+        self.client.uploaded[rpc.file_id] = self.client.uploaded.get(rpc.file_id, 0) + len(rpc.bytes)
+
+    async def stop(self):
+        pass
+
+class FakeClient:
+    """
+    Pyrogram Client stand-in. Downloads write a synthetic file of the
+    media's size and uploads read the whole document, both paced by
+    `bandwidth` bytes/sec plus a fixed per-call `latency`.
+    """
+
+    def __init__(self, bandwidth=50 * 1024 * 1024, latency=0.05, bot_id=1):
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.me = SimpleNamespace(id=bot_id, is_premium=False)
+        self.sent = []
+        self.messages = {}
+        self.edits = 0
+        self.bytes_down = 0
+        self.bytes_up = 0
+        self.uploaded = {}  # file_id -> bytes saved through upload_session parts
+        self._rnd = itertools.count(1)
+
+    def rnd_id(self):
+        return next(self._rnd)
+
+    async def upload_session(self):
+        """Stand-in for transfer._upload_session: saves raw file parts at `bandwidth`."""
+        return FakeUploadSession(self)
+
+    async def _pace(self, nbytes, progress, total, done, args=()):
+        await asyncio.sleep(nbytes / self.bandwidth)
+        if progress:
+            await progress(done, total, *args)
+
+    async def download_media(self, message, file_name=None, progress=None, **kwargs):
+        media = message.document if hasattr(message, "document") else None
+        size = media.file_size if media else 64 * 1024
+        await asyncio.sleep(self.latency)
+        block = synthetic_block()
+        with open(file_name, "wb") as f:
+            done = 0
+            while done < size:
+                n = min(len(block), size - done)
+                f.write(block[:n])
+                done += n
+                await self._pace(n, progress, size, done)
+        self.bytes_down += size
+        return file_name
+
+    async def stream_media(self, message, limit=0, offset=0):
+        size = message.document.file_size
+        block = synthetic_block()
+        chunk = 1024 * 1024
+        pos = offset * chunk
+        count = 0
+        await asyncio.sleep(self.latency)
+        while pos < size and (not limit or count < limit):
+            n = min(chunk, size - pos)
+            await asyncio.sleep(n / self.bandwidth)
+            self.bytes_down += n
+            yield block[:n]
+            pos += n
+            count += 1
+
+    async def _read_upload(self, document, progress, args=()):
+        if isinstance(document, (str, os.PathLike)):
+            fp = open(document, "rb")
+            close = True
+        else:
+            fp, close = document, False
+        try:
+            fp.seek(0, io.SEEK_END)
+            total = fp.tell()
+            fp.seek(0)
+            done = 0
+            while True:
+                chunk = fp.read(512 * 1024)
+                if not chunk:
+                    break
+                done += len(chunk)
+                await self._pace(len(chunk), progress, total, done, args)
+        finally:
+            if close:
+                fp.close()
+        self.bytes_up += total
+        return total
+
+    async def send_document(self, chat_id, document, file_name=None, caption=None, progress=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        size = await self._read_upload(document, progress)
+        name = file_name or getattr(document, "name", None) or os.path.basename(str(document))
+        media = SimpleNamespace(file_id=f"F{next(FakeMessage._ids)}", file_unique_id=f"U{name}", file_name=name, file_size=size)
+        return self._record(FakeMessage(self, chat_id, self.me.id, caption=caption, media=media))
+
+    async def send_video(self, chat_id, video, **kwargs):
+        return await self.send_document(chat_id, video, **kwargs)
+
+    async def send_audio(self, chat_id, audio, **kwargs):
+        return await self.send_document(chat_id, audio, **kwargs)
+
+    async def save_file(self, path, progress=None, progress_args=(), **kwargs):
+        await asyncio.sleep(self.latency)
+        size = await self._read_upload(path, progress, progress_args)
+        name = getattr(path, "name", None) or os.path.basename(str(path))
+        return SimpleNamespace(id=next(FakeMessage._ids), name=name, size=size)
+
+    async def send_uploaded(self, chat_id, input_file, file_name, caption=None, attributes=(), thumb=None):
+        """Stand-in for transfer._send_uploaded (raw SendMedia of a saved file)."""
+        await asyncio.sleep(self.latency)
+        size = getattr(input_file, "size", None) or self.uploaded.pop(input_file.id, 0)
+        media = SimpleNamespace(file_id=f"F{input_file.id}", file_unique_id=f"U{input_file.id}", file_name=file_name, file_size=size)
+        return self._record(FakeMessage(self, chat_id, self.me.id, caption=caption, media=media))
+
+    async def send_cached_media(self, chat_id, file_id, caption=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        media = SimpleNamespace(file_id=file_id, file_unique_id=file_id, file_name=None, file_size=0)
+        return self._record(FakeMessage(self, chat_id, self.me.id, caption=caption, media=media))
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self._record(FakeMessage(self, chat_id, self.me.id, text=text))
+
+    async def get_messages(self, chat_id, message_ids):
+        await asyncio.sleep(self.latency)
+        if isinstance(message_ids, list):
+            return [self.messages.get((chat_id, i)) for i in message_ids]
+        return self.messages.get((chat_id, message_ids))
+
+    async def get_chat_member(self, chat_id, user_id):
+        return SimpleNamespace(status=None)
+
+    def _record(self, msg):
+        self.sent.append(msg)
+        return msg
+
+_block = None
+
+def synthetic_block(size=1024 * 1024):
+    """1 MiB of random bytes, repeated to build synthetic files (incompressible, like real media)."""
+    global _block
+    if _block is None:
+        _block = os.urandom(size)
+    return _block
+
+def make_file(path, size, compressible=False):
+    """Write a synthetic file of `size` bytes for the standalone benchmarks."""
+    block = (b"lorem ipsum dolor sit amet " * 40000)[:len(synthetic_block())] if compressible else synthetic_block()
+    with open(path, "wb") as f:
+        left = size
+        while left > 0:
+            n = min(left, len(block))
+            f.write(block[:n])
+            left -= n
+    return path
+
+def fake_file_message(client, chat_id, user_id, size, name="video.mkv", duration=60):
+    # a video Telegram knows the attributes of; duration=None models a bare document
+    media = SimpleNamespace(
+        duration=duration,
+        width=1280 if duration else None,
+        height=720 if duration else None,
+        file_id=f"F{next(FakeMessage._ids)}",
+        file_unique_id=f"U{next(FakeMessage._ids)}",
+        file_name=name,
+        file_size=size,
+        mime_type="application/octet-stream",
+        thumbs=None,
+    )
+    return FakeMessage(client, chat_id, user_id, media=media)
+
+def peak_rss_mb():
+    import resource
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return own / 1024, children / 1024
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return total
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
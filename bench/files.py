@@ -0,0 +1,87 @@
+"""
+Standalone benchmarks for the file primitives in helper.py and
+compressor.py across file sizes: split_file vs split_ranges and zip_file
+vs zip_to_volumes, reporting MiB/s, peak Python memory and bytes written.
+
+    python -m bench.files --sizes 16,128,512 --split-mb 64
+"""
+import os
+import sys
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helper import split_file, split_ranges, zip_file
+from compressor import zip_to_volumes
+from bench.fakes import make_file, dir_size, Timer
+
+def drain(fp, chunk=512 * 1024):
+    # read the way Pyrogram's save_file does
+    while fp.read(chunk):
+        pass
+
+def bench_split_file(src, part_bytes, out):
+    parts = split_file(src, part_bytes)
+    for p in parts:
+        with open(p, "rb") as f:
+            drain(f)
+    return parts
+
+def bench_split_ranges(src, part_bytes, out):
+    parts = split_ranges(src, part_bytes)
+    for p in parts:
+        with p:
+            drain(p)
+    return []
+
+def bench_zip_file(src, part_bytes, out):
+    dest = os.path.join(out, "a.zip")
+    zip_file(src, dest)
+    return [dest] + split_file(dest, part_bytes) if os.path.getsize(dest) > part_bytes else [dest]
+
+def bench_zip_volumes(src, part_bytes, out):
+    volumes, _ = zip_to_volumes(src, os.path.join(out, "b.zip"), "src", part_bytes, part_bytes)
+    return volumes
+
+CASES = [
+    ("split_file", bench_split_file),
+    ("split_ranges", bench_split_ranges),
+    ("zip_file", bench_zip_file),
+    ("zip_to_volumes", bench_zip_volumes),
+]
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--sizes", default="16,64,256", help="file sizes in MiB")
+    p.add_argument("--split-mb", type=int, default=32)
+    p.add_argument("--compressible", action="store_true", help="use text-like data instead of random bytes")
+    p.add_argument("--only", default="", help="comma separated case names")
+    args = p.parse_args()
+    only = set(filter(None, args.only.split(",")))
+    part_bytes = args.split_mb * 1024 * 1024
+
+    print(f"{'case':<16}{'size MiB':>10}{'secs':>9}{'MiB/s':>9}{'peak mem MiB':>14}{'written MiB':>13}")
+    for size_mb in (int(s) for s in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory(prefix="renamebench") as tmp:
+            src = make_file(os.path.join(tmp, "src.mkv" if not args.compressible else "src.txt"), size_mb * 1024 * 1024, args.compressible)
+            for name, fn in CASES:
+                if only and name not in only:
+                    continue
+                out = os.path.join(tmp, name)
+                os.makedirs(out)
+                tracemalloc.start()
+                with Timer() as t:
+                    fn(src, part_bytes, out)
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                # split_file writes its parts next to the source
+                written = dir_size(out) + sum(os.path.getsize(os.path.join(tmp, f)) for f in os.listdir(tmp) if ".part" in f)
+                for f in os.listdir(tmp):
+                    if ".part" in f:
+                        os.remove(os.path.join(tmp, f))
+                print(f"{name:<16}{size_mb:>10}{t.elapsed:>9.2f}{size_mb / t.elapsed:>9.1f}{peak / 1024 / 1024:>14.1f}{written / 1024 / 1024:>13.1f}")
+
+if __name__ == "__main__":
+    main()
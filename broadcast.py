@@ -0,0 +1,155 @@
+import time
+import asyncio
+import logging
+from datetime import datetime
+from pymongo import ReturnDocument
+from pyrogram.errors import FloodWait, UserIsBlocked, InputUserDeactivated, UserDeactivated
+from config import Config
+from database import users, broadcasts, delete_users, log_action
+from metrics import floodwait
+
+logger = logging.getLogger(__name__)
+
+# errors that mean the user is gone for good and can be dropped from `users`
+GONE_ERRORS = (UserIsBlocked, InputUserDeactivated, UserDeactivated)
+
+class TokenBucket:
+    """
+    Rate limiter shared by all senders of a broadcast. A FloodWait pauses
+    everyone for the requested time and halves the rate, which then creeps
+    back up to `rate` as sends succeed.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self.tokens = min(self.burst, self.tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def flood_wait(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self.rate = max(self.max_rate / 8, self.rate / 2)
+        self.tokens = 0
+
+    def success(self):
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate * 1.02)
+
+async def _send_one(client, uid, text, bucket):
+    for _ in range(Config.BROADCAST_RETRIES):
+        await bucket.acquire()
+        try:
+            await client.send_message(uid, text)
+            bucket.success()
+            return "sent", None
+        except FloodWait as e:
+            floodwait("broadcast", e.value)
+            bucket.flood_wait(e.value)
+        except GONE_ERRORS as e:
+            return "pruned", type(e).__name__
+        except Exception as e:
+            return "failed", type(e).__name__
+    return "failed", "FloodWait"
+
+_running = {}
+
+async def run_broadcast(client, bid):
+    """Send (or continue sending) broadcast `bid`, checkpointing after every page of users."""
+    doc = await broadcasts.find_one({"_id": bid})
+    if not doc or doc.get("status") == "done":
+        return
+    bucket = TokenBucket(Config.BROADCAST_RATE)
+    sem = asyncio.Semaphore(Config.BROADCAST_CONCURRENCY)
+    last_id = doc.get("last_id")
+
+    async def send(uid):
+        async with sem:
+            return uid, await _send_one(client, uid, doc["text"], bucket)
+
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        page = await users.find(query, {"_id": 1}).sort("_id", 1).limit(Config.BROADCAST_PAGE).to_list(None)
+        if not page:
+            break
+        results = await asyncio.gather(*(send(u["_id"]) for u in page))
+        sent = sum(1 for _, (r, _) in results if r == "sent")
+        gone = [uid for uid, (r, _) in results if r == "pruned"]
+        failures = [{"user": uid, "error": err} for uid, (r, err) in results if r == "failed"]
+        if gone:
+            await delete_users(gone)
+        last_id = page[-1]["_id"]
+        update = {
+            "$set": {"last_id": last_id, "updated": datetime.utcnow()},
+            "$inc": {"sent": sent, "failed": len(failures), "pruned": len(gone)},
+        }
+        if failures:
+            update["$push"] = {"failures": {"$each": failures, "$slice": -Config.BROADCAST_KEEP_FAILURES}}
+        await broadcasts.update_one({"_id": bid}, update)
+
+    doc = await broadcasts.find_one_and_update({"_id": bid}, {"$set": {"status": "done", "updated": datetime.utcnow()}}, return_document=ReturnDocument.AFTER)
+    await log_action({"user": doc["admin"], "action": "broadcast", "sent": doc.get("sent", 0), "failed": doc.get("failed", 0), "pruned": doc.get("pruned", 0)})
+    try:
+        await client.send_message(doc["admin"], f"Broadcast {bid} finished. Sent: {doc.get('sent',0)}, failed: {doc.get('failed',0)}, pruned: {doc.get('pruned',0)}.")
+    except Exception:
+        pass
+
+def start_broadcast(client, bid):
+    """Run a broadcast in the background unless it is already running in this process."""
+    task = _running.get(bid)
+    if task and not task.done():
+        return task
+
+    async def runner():
+        try:
+            await run_broadcast(client, bid)
+        except Exception:
+            logger.exception("Broadcast %s stopped; it will resume from its last checkpoint", bid)
+        finally:
+            _running.pop(bid, None)
+
+    task = _running[bid] = asyncio.create_task(runner())
+    return task
+
+async def new_broadcast(client, admin_id, text):
+    res = await broadcasts.insert_one({
+        "text": text,
+        "admin": admin_id,
+        "status": "running",
+        "last_id": None,
+        "sent": 0,
+        "failed": 0,
+        "pruned": 0,
+        "failures": [],
+        "created": datetime.utcnow(),
+        "updated": datetime.utcnow(),
+    })
+    start_broadcast(client, res.inserted_id)
+    return res.inserted_id
+
+async def resume_broadcasts(client):
+    """Pick up broadcasts interrupted by a restart."""
+    async for doc in broadcasts.find({"status": "running"}, {"_id": 1}):
+        logger.info("Resuming broadcast %s", doc["_id"])
+        start_broadcast(client, doc["_id"])
+
+async def broadcast_status(bid=None):
+    if bid is None:
+        return await broadcasts.find_one({}, sort=[("created", -1)])
+    return await broadcasts.find_one({"_id": bid})
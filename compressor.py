@@ -0,0 +1,115 @@
+import os, zlib, zipfile, asyncio, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from config import Config
+
+# containers that are already compressed; deflating them only burns CPU
+STORED_EXTS = {
+    ".mp4", ".mkv", ".avi", ".mov", ".webm", ".m4v", ".flv",
+    ".mp3", ".m4a", ".aac", ".ogg", ".opus", ".flac",
+    ".jpg", ".jpeg", ".png", ".webp", ".gif",
+    ".zip", ".rar", ".7z", ".gz", ".bz2", ".xz", ".zst", ".apk",
+}
+
+_pool = None
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        # forkserver: by now the bot runs motor/pyrogram threads, and forking a threaded process can deadlock the child
+        _pool = ProcessPoolExecutor(max_workers=Config.COMPRESS_WORKERS, mp_context=multiprocessing.get_context("forkserver"))
+    return _pool
+
+def sample_ratio(path, samples=8, sample_size=64 * 1024):
+    """Deflate a few evenly spaced samples of the file and return compressed/raw size."""
+    size = os.path.getsize(path)
+    if size == 0:
+        return 1.0
+    step = max(size // samples, sample_size)
+    raw = packed = 0
+    with open(path, "rb") as f:
+        for offset in range(0, size, step):
+            f.seek(offset)
+            block = f.read(sample_size)
+            raw += len(block)
+            packed += len(zlib.compress(block, 1))
+    return packed / raw
+
+def choose_method(path, name=None):
+    """Returns (compress_type, estimated ratio) for the file; `name` is its real file name if `path` has none."""
+    if os.path.splitext(name or path)[1].lower() in STORED_EXTS:
+        return zipfile.ZIP_STORED, 1.0
+    ratio = sample_ratio(path)
+    if ratio >= Config.COMPRESS_MIN_RATIO:
+        return zipfile.ZIP_STORED, 1.0
+    return zipfile.ZIP_DEFLATED, ratio
+
+class VolumeWriter:
+    """
+    Write-only stream that spreads its output over `<dest>.partNNN` files of at
+    most `volume_size` bytes. It has no seek/tell, so zipfile streams entries
+    with data descriptors and the volumes concatenate back into a valid zip.
+    """
+
+    def __init__(self, dest, volume_size):
+        self.dest = dest
+        self.volume_size = volume_size
+        self.volumes = []
+        self._fp = None
+        self._left = 0
+
+    def _next_volume(self):
+        if self._fp:
+            self._fp.close()
+        path = f"{self.dest}.part{len(self.volumes)+1:03d}"
+        self._fp = open(path, "wb")
+        self.volumes.append(path)
+        self._left = self.volume_size
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            if self._left == 0:
+                self._next_volume()
+            n = min(len(view), self._left)
+            self._fp.write(view[:n])
+            self._left -= n
+            view = view[n:]
+        return len(data)
+
+    def flush(self):
+        if self._fp:
+            self._fp.flush()
+
+    def close(self):
+        if self._fp:
+            self._fp.close()
+            self._fp = None
+        # a single volume is just the zip itself
+        if len(self.volumes) == 1:
+            os.replace(self.volumes[0], self.dest)
+            self.volumes = [self.dest]
+
+def zip_to_volumes(src_path, dest_zip, arcname, max_single_bytes, volume_bytes, level=6):
+    """
+    Zip src_path straight into size-capped volumes. Runs in a worker process.
+    Returns (volume paths, compress_type).
+    """
+    # the source is a temp download without an extension; the archive name carries the real one
+    method, ratio = choose_method(src_path, arcname)
+    # keep the archive in one piece if it should fit in a single upload
+    fits = os.path.getsize(src_path) * ratio <= max_single_bytes
+    writer = VolumeWriter(dest_zip, max_single_bytes if fits else volume_bytes)
+    try:
+        with zipfile.ZipFile(writer, "w", compression=method, compresslevel=level, allowZip64=True) as zf:
+            zf.write(src_path, arcname=arcname)
+    finally:
+        writer.close()
+    return writer.volumes, method
+
+async def compress(src_path, dest_zip, arcname):
+    """Zip a file in the process pool without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_pool(), zip_to_volumes, src_path, dest_zip, arcname,
+        Config.MAX_UPLOAD_MB * 1024 * 1024, Config.SPLIT_SIZE_MB * 1024 * 1024, Config.COMPRESS_LEVEL,
+    )
@@ -6,8 +6,104 @@ class Config:
     BOT_TOKEN = os.environ.get("BOT_TOKEN", "6576656517:AAEJYpjxYK-KEy3d8ZYNRZJoLi7bIKmRrMY")
 
     # Optional
-    SHORTNER_API = os.environ.get("SHORTNER_API", "fc8615a8e5996ddd180167f66153bd1d123ba009")
-    SHORTNER_URL = os.environ.get("SHORTNER_URL", "https://linkshortify.com")
+    SHORTENER_API = os.environ.get("SHORTENER_API", "fc8615a8e5996ddd180167f66153bd1d123ba009")
+    SHORTENER_URL = os.environ.get("SHORTENER_URL", "https://linkshortify.com")
+    SHORTENER_TIMEOUT = float(os.environ.get("SHORTENER_TIMEOUT", "5"))
+    SHORTENER_POOL = int(os.environ.get("SHORTENER_POOL", "10"))
+    SHORTENER_CACHE_SIZE = int(os.environ.get("SHORTENER_CACHE_SIZE", "10000"))
+    SHORTENER_CACHE_TTL = int(os.environ.get("SHORTENER_CACHE_TTL", "86400"))
+    SHORTENER_FAILURES = int(os.environ.get("SHORTENER_FAILURES", "3"))  # consecutive failures before falling back
+    SHORTENER_COOLDOWN = int(os.environ.get("SHORTENER_COOLDOWN", "60"))
+
+    FS_CHANNEL_ID = int(os.environ.get("FS_CHANNEL_ID", "0"))  # force-subscribe channel, 0 disables
+    FS_MEMBER_TTL = int(os.environ.get("FS_MEMBER_TTL", "600"))  # seconds a "joined" answer is reused
+    FS_NONMEMBER_TTL = int(os.environ.get("FS_NONMEMBER_TTL", "15"))  # short, so users who just joined get in quickly
+    FS_CACHE_SIZE = int(os.environ.get("FS_CACHE_SIZE", "50000"))
 
     BOT_USERNAME = "@Merge_Paradox_Bot"
     OWNER_ID = int(os.environ.get("OWNER_ID", "916551125"))
+
+    # Database
+    MONGO_URI = os.environ.get("MONGO_URI", "")  # required; never commit credentials here
+    MONGO_DBNAME = os.environ.get("MONGO_DBNAME", "rename_bot")
+    DEFAULT_DAILY_LIMIT = int(os.environ.get("DEFAULT_DAILY_LIMIT", "10"))
+    ADMINS = [int(x) for x in os.environ.get("ADMINS", "").split()] + [OWNER_ID]
+    USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "5000"))
+    USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", "300"))
+
+    # Uploads / compression
+    MAX_UPLOAD_MB = int(os.environ.get("MAX_UPLOAD_MB", "2000"))
+    SPLIT_SIZE_MB = int(os.environ.get("SPLIT_SIZE_MB", "1900"))
+    COMPRESS_WORKERS = int(os.environ.get("COMPRESS_WORKERS", str(os.cpu_count() or 2)))
+    COMPRESS_LEVEL = int(os.environ.get("COMPRESS_LEVEL", "6"))
+    COMPRESS_MIN_RATIO = float(os.environ.get("COMPRESS_MIN_RATIO", "0.9"))  # store instead of deflate above this sampled ratio
+
+    # Job queue (jobs collection; any number of worker processes claim from it)
+    JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))  # jobs run at once per worker process
+    JOB_PER_USER = int(os.environ.get("JOB_PER_USER", "1"))  # running jobs per user across all workers
+    JOB_LEASE = int(os.environ.get("JOB_LEASE", "60"))  # seconds a claim lasts without a heartbeat
+    JOB_HEARTBEAT = int(os.environ.get("JOB_HEARTBEAT", "10"))
+    JOB_POLL = float(os.environ.get("JOB_POLL", "2"))  # idle workers look for new jobs this often
+    JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))  # claims before a job whose worker keeps dying is failed
+    JOB_RETENTION_DAYS = int(os.environ.get("JOB_RETENTION_DAYS", "7"))  # finished jobs are kept this long; 0 keeps them
+    EMBEDDED_WORKER = os.environ.get("EMBEDDED_WORKER", "true").lower() in ("1", "true", "yes")  # bot process runs jobs too
+    WORKER_ID = os.environ.get("WORKER_ID", "")  # names the worker's files for resuming; defaults to the host name. Set it (and TMP_DIR) per worker when several share a host
+
+    # Batch rename (/batch template, send files, /done)
+    BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", "100"))
+    BATCH_PREFETCH = int(os.environ.get("BATCH_PREFETCH", "2"))  # files downloaded ahead of the upload
+    BATCH_COLLECT_TTL = int(os.environ.get("BATCH_COLLECT_TTL", "1800"))  # seconds an unfinished /batch stays open
+
+    # Broadcast
+    BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", "25"))  # messages per second
+    BROADCAST_CONCURRENCY = int(os.environ.get("BROADCAST_CONCURRENCY", "20"))
+    BROADCAST_PAGE = int(os.environ.get("BROADCAST_PAGE", "500"))
+    BROADCAST_RETRIES = int(os.environ.get("BROADCAST_RETRIES", "3"))
+    BROADCAST_KEEP_FAILURES = int(os.environ.get("BROADCAST_KEEP_FAILURES", "1000"))
+
+    # Action logs
+    LOG_BATCH_SIZE = int(os.environ.get("LOG_BATCH_SIZE", "200"))
+    LOG_FLUSH_INTERVAL = float(os.environ.get("LOG_FLUSH_INTERVAL", "2"))
+    LOG_MAX_PENDING = int(os.environ.get("LOG_MAX_PENDING", "10000"))
+    LOG_RETENTION_DAYS = int(os.environ.get("LOG_RETENTION_DAYS", "0"))  # 0 keeps logs forever
+
+    # NSFW scanning
+    USE_NSFW = os.environ.get("USE_NSFW", "false").lower() in ("1", "true", "yes")
+    NSFW_THRESHOLD = float(os.environ.get("NSFW_THRESHOLD", "0.7"))
+    NSFW_BATCH_SIZE = int(os.environ.get("NSFW_BATCH_SIZE", "8"))
+    NSFW_BATCH_WINDOW = float(os.environ.get("NSFW_BATCH_WINDOW", "0.2"))  # seconds to wait for a batch to fill
+    NSFW_CACHE_SIZE = int(os.environ.get("NSFW_CACHE_SIZE", "20000"))
+    NSFW_CACHE_TTL = int(os.environ.get("NSFW_CACHE_TTL", "86400"))
+
+    # Result index (re-send earlier compress/split outputs by file_id)
+    RESULT_TTL_DAYS = int(os.environ.get("RESULT_TTL_DAYS", "30"))
+
+    # Temp storage
+    TMP_DIR = os.environ.get("TMP_DIR", "downloads")
+    THUMB_DIR = os.environ.get("THUMB_DIR", "thumbs")
+    TMP_BUDGET_MB = int(os.environ.get("TMP_BUDGET_MB", "0"))  # 0 = whatever the disk has free
+    TMP_MIN_FREE_MB = int(os.environ.get("TMP_MIN_FREE_MB", "512"))
+    TMP_WAIT = int(os.environ.get("TMP_WAIT", "1800"))  # seconds a job may wait for space
+
+    # Progress messages
+    PROGRESS_INTERVAL = float(os.environ.get("PROGRESS_INTERVAL", "5"))  # min seconds between status edits
+
+    # Metrics endpoint (Prometheus text format at /metrics); 0 disables it
+    METRICS_PORT = int(os.environ.get("METRICS_PORT", "9731"))  # bot process
+    WORKER_METRICS_PORT = int(os.environ.get("WORKER_METRICS_PORT", "0"))  # standalone worker.py; each worker on a host needs its own
+    METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+
+    # Transfers
+    MAX_TRANSMISSIONS = int(os.environ.get("MAX_TRANSMISSIONS", "8"))  # concurrent get_file/save_file calls per client
+    PARALLEL_MIN_MB = int(os.environ.get("PARALLEL_MIN_MB", "64"))  # files from this size download over several ranges
+    DOWNLOAD_CONNECTIONS = int(os.environ.get("DOWNLOAD_CONNECTIONS", "4"))
+    STREAM_RETRIES = int(os.environ.get("STREAM_RETRIES", "3"))  # early-ended streams in a row, with backoff, before a download fails
+    UPLOAD_CONCURRENCY = int(os.environ.get("UPLOAD_CONCURRENCY", "3"))
+    STREAM_RENAME = os.environ.get("STREAM_RENAME", "true").lower() in ("1", "true", "yes")  # renames pipe download into upload, no temp file
+    STREAM_BUFFER_MB = int(os.environ.get("STREAM_BUFFER_MB", "8"))  # downloaded bytes waiting for upload, per streaming rename
+    STREAM_UPLOAD_WORKERS = int(os.environ.get("STREAM_UPLOAD_WORKERS", "4"))
+
+    # Media probing (container headers only, in a thread pool)
+    PROBE_WORKERS = int(os.environ.get("PROBE_WORKERS", "2"))
+    PROBE_CACHE_SIZE = int(os.environ.get("PROBE_CACHE_SIZE", "5000"))
+    PROBE_CACHE_TTL = int(os.environ.get("PROBE_CACHE_TTL", "86400"))
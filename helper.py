@@ -1,25 +1,8 @@
-import os, math, zipfile, shutil, asyncio
-from hachoir.parser import createParser
-from hachoir.metadata import extractMetadata
+import io, os, math, zipfile, shutil, asyncio
 from config import Config
 from pyrogram import Client
 from math import ceil
 
-async def extract_metadata(file_path):
-    try:
-        parser = createParser(file_path)
-        metadata = extractMetadata(parser)
-        if not metadata:
-            return {}
-        data = metadata.exportDictionary()
-        # flatten to string-friendly map
-        out = {}
-        for k, v in data.items():
-            out[k] = str(v)
-        return out
-    except Exception:
-        return {}
-
 def ensure_dirs():
     os.makedirs(Config.TMP_DIR, exist_ok=True)
     os.makedirs(Config.THUMB_DIR, exist_ok=True)
@@ -36,6 +19,69 @@ def split_file(file_path, chunk_size_bytes):
             parts.append(part_path)
     return parts
 
+class FileRange(io.RawIOBase):
+    """
+    Read-only, seekable view over bytes [offset, offset+length) of a file.
+    Lets a part of a big file be uploaded without copying it to disk; reads
+    go straight to the source file so memory stays at the caller's buffer.
+    """
+
+    def __init__(self, path, offset, length, name=None):
+        super().__init__()
+        self.path = path
+        self.offset = offset
+        self.length = length
+        self.name = name or os.path.basename(path)
+        self._pos = 0
+        self._fp = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence == io.SEEK_END:
+            pos += self.length
+        if pos < 0:
+            raise ValueError("negative seek position")
+        self._pos = min(pos, self.length)
+        return self._pos
+
+    def readinto(self, b):
+        n = min(len(b), self.length - self._pos)
+        if n <= 0:
+            return 0
+        if self._fp is None:
+            # opened lazily so a list of ranges does not hold a fd per part
+            self._fp = open(self.path, "rb", buffering=0)
+        self._fp.seek(self.offset + self._pos)
+        n = self._fp.readinto(memoryview(b)[:n])
+        self._pos += n
+        return n
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+        super().close()
+
+def split_ranges(file_path, chunk_size_bytes):
+    """Same layout as split_file, but returns FileRange views instead of writing .partNNN copies."""
+    total = os.path.getsize(file_path)
+    count = ceil(total / chunk_size_bytes)
+    base = os.path.basename(file_path)
+    return [
+        FileRange(file_path, i * chunk_size_bytes, min(chunk_size_bytes, total - i * chunk_size_bytes), name=f"{base}.part{i+1:03d}")
+        for i in range(count)
+    ]
+
 def zip_file(src_path, dest_zip):
     with zipfile.ZipFile(dest_zip, "w", compression=zipfile.ZIP_DEFLATED) as zf:
         arcname = os.path.basename(src_path)
@@ -0,0 +1,235 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from config import Config
+from database import jobs
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 0   # premium / admin
+PRIORITY_NORMAL = 1
+
+# Job documents:
+#   {_id, key, active_key, user_id, op, payload, quota, priority, status, created, attempts,
+#    worker, user_slot, lease_until, started, cancel_requested, finished, result, error, state}
+# status: queued -> running -> done | failed | cancelled (running -> queued again if the lease expires)
+# `worker` is the lease owner, unique per process. `state` is what a later run needs to resume:
+# {worker, downloaded, volumes, parts, sent: [{part, message_id, file_id, caption}]}, where
+# state.worker is the stable name (WORKER_ID or host) of the worker whose disk holds the files.
+# `active_key` only exists while the job is queued or running; its unique index stops the same
+# file from being queued twice. `user_slot` ("<user_id>:<n>", n < JOB_PER_USER) only exists while
+# the job is running; its unique index holds the per-user cap however many workers claim at once.
+
+_wake = None
+_counts = {}
+
+def job_key(chat_id, message_id):
+    return f"{chat_id}:{message_id}"
+
+def _wakeup():
+    if _wake is not None:
+        _wake.set()
+
+async def wait(timeout):
+    """Sleep until a job is enqueued in this process or `timeout` passes."""
+    global _wake
+    if _wake is None:
+        _wake = asyncio.Event()
+    try:
+        await asyncio.wait_for(_wake.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    _wake.clear()
+
+async def enqueue(key, user_id, op, payload, priority=PRIORITY_NORMAL, quota=1):
+    """
+    Queue a job holding `quota` of the user's daily slots. Returns its queue
+    position (0 = next up), or None if `key` is already queued or running.
+    """
+    token = ObjectId()
+    try:
+        doc = await jobs.find_one_and_update(
+            {"active_key": key},
+            {"$setOnInsert": {
+                "key": key, "token": token, "user_id": user_id, "op": op, "payload": payload, "quota": quota,
+                "priority": priority, "status": "queued", "created": datetime.utcnow(), "attempts": 0,
+            }},
+            upsert=True, return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # lost a race with a concurrent enqueue of the same key
+        return None
+    if doc["token"] != token:
+        return None
+    _wakeup()
+    return await position(doc)
+
+async def position(doc):
+    return await jobs.count_documents({"status": "queued", "$or": [
+        {"priority": {"$lt": doc["priority"]}},
+        {"priority": doc["priority"], "created": {"$lt": doc["created"]}},
+    ]})
+
+async def claim(worker_id):
+    """Take the next queued job whose user is under JOB_PER_USER running jobs, or None."""
+    full = []
+    while True:
+        query = {"status": "queued"}
+        if full:
+            query["user_id"] = {"$nin": full}
+        doc = await jobs.find_one(query, {"user_id": 1}, sort=[("priority", 1), ("created", 1)])
+        if doc is None:
+            return None
+        user_id = doc["user_id"]
+        running = await jobs.find({"status": "running", "user_id": user_id}, {"user_slot": 1}).to_list(None)
+        taken = {d.get("user_slot") for d in running}
+        for n in range(Config.JOB_PER_USER):
+            slot = f"{user_id}:{n}"
+            if slot in taken:
+                continue
+            now = datetime.utcnow()
+            try:
+                claimed = await jobs.find_one_and_update(
+                    {"_id": doc["_id"], "status": "queued"},
+                    {"$set": {"status": "running", "worker": worker_id, "user_slot": slot, "started": now,
+                              "lease_until": now + timedelta(seconds=Config.JOB_LEASE)},
+                     "$inc": {"attempts": 1}},
+                    return_document=ReturnDocument.AFTER,
+                )
+            except DuplicateKeyError:
+                # another worker took this slot since we looked
+                continue
+            if claimed is None:
+                # another worker took the job; pick again
+                break
+            return claimed
+        else:
+            full.append(user_id)
+
+async def heartbeat(job_id, worker_id):
+    """Extends the lease. Returns None if this worker no longer owns the job, else {cancel_requested}."""
+    return await jobs.find_one_and_update(
+        {"_id": job_id, "worker": worker_id, "status": "running"},
+        {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=Config.JOB_LEASE)}},
+        projection={"cancel_requested": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+
+async def finish(job_id, worker_id, status, **fields):
+    """Record the outcome (done / failed / cancelled) of a job this worker owns."""
+    await jobs.update_one(
+        {"_id": job_id, "worker": worker_id, "status": "running"},
+        {"$set": {"status": status, "finished": datetime.utcnow(), **fields},
+         "$unset": {"active_key": "", "lease_until": "", "user_slot": ""}},
+    )
+
+async def save_state(job_id, worker_id, name, **fields):
+    """Persist resume state of a job this worker is running; `name` is the worker's stable name."""
+    update = {f"state.{k}": v for k, v in fields.items()}
+    update["state.worker"] = name
+    await jobs.update_one({"_id": job_id, "worker": worker_id, "status": "running"}, {"$set": update})
+
+async def add_sent(job_id, worker_id, entry):
+    """Record one delivered output so a resumed run does not send it again."""
+    await jobs.update_one({"_id": job_id, "worker": worker_id, "status": "running"}, {"$push": {"state.sent": entry}})
+
+async def requeue_worker(name):
+    """
+    At worker startup: jobs whose files are on this worker's disk and whose
+    lease owner is gone go back to the queue. Live jobs of another process
+    with the same name keep running; cancelled ones are left to the reaper.
+    """
+    res = await jobs.update_many(
+        {"status": "running", "state.worker": name, "cancel_requested": {"$ne": True},
+         "$or": [{"lease_until": {"$lt": datetime.utcnow()}}, {"lease_until": {"$exists": False}}]},
+        {"$set": {"status": "queued"}, "$unset": {"worker": "", "lease_until": "", "user_slot": ""}},
+    )
+    if res.matched_count:
+        logger.info("Requeued %d jobs interrupted on %s", res.matched_count, name)
+        _wakeup()
+
+async def resumable():
+    """
+    Keys whose job directories a TMP_DIR sweep must keep: every running job
+    and every queued job with saved state. Not only this worker's: another
+    worker may share the directory.
+    """
+    docs = await jobs.find({"$or": [
+        {"status": "queued", "state": {"$exists": True}},
+        {"status": "running"},
+    ]}, {"key": 1}).to_list(None)
+    return [d["key"] for d in docs]
+
+async def release(job_id, worker_id):
+    """Hand a job back to the queue, e.g. when its worker shuts down mid-run."""
+    await jobs.update_one(
+        {"_id": job_id, "worker": worker_id, "status": "running"},
+        {"$set": {"status": "queued"}, "$unset": {"worker": "", "lease_until": "", "user_slot": ""}, "$inc": {"attempts": -1}},
+    )
+    _wakeup()
+
+async def requeue_expired():
+    """
+    Put jobs whose worker stopped heartbeating back in the queue. Jobs the
+    user cancelled meanwhile, or that already used JOB_MAX_ATTEMPTS claims,
+    are ended instead; those are returned (with their new status) so the
+    caller can tell the user and refund the quota.
+    """
+    now = datetime.utcnow()
+    ended = []
+    async for doc in jobs.find({"status": "running", "lease_until": {"$lt": now}}):
+        if doc.get("cancel_requested"):
+            update = {"$set": {"status": "cancelled", "finished": now},
+                      "$unset": {"active_key": "", "lease_until": "", "user_slot": ""}}
+        elif doc.get("attempts", 0) >= Config.JOB_MAX_ATTEMPTS:
+            update = {"$set": {"status": "failed", "finished": now, "error": "worker lost"},
+                      "$unset": {"active_key": "", "lease_until": "", "user_slot": ""}}
+        else:
+            update = {"$set": {"status": "queued"}, "$unset": {"worker": "", "lease_until": "", "user_slot": ""}}
+        # the lease condition makes this a no-op if the worker came back meanwhile
+        done = await jobs.find_one_and_update({"_id": doc["_id"], "status": "running", "lease_until": {"$lt": now}}, update)
+        if done is None:
+            continue
+        logger.warning("Job %s lost its worker %s", doc["key"], doc.get("worker"))
+        if "active_key" in update["$unset"]:
+            doc["status"] = update["$set"]["status"]
+            ended.append(doc)
+    return ended
+
+async def cancel(key):
+    """
+    Cancel the active job for `key` and return its document as it was, or
+    None if there is no such job. A queued job (status "queued") is
+    cancelled at once and its quota is the caller's to refund; a running
+    one is flagged and its worker stops it at the next heartbeat.
+    """
+    doc = await jobs.find_one_and_update(
+        {"active_key": key, "status": "queued"},
+        {"$set": {"status": "cancelled", "finished": datetime.utcnow()}, "$unset": {"active_key": ""}},
+    )
+    if doc:
+        return doc
+    return await jobs.find_one_and_update({"active_key": key, "status": "running"}, {"$set": {"cancel_requested": True}})
+
+async def refresh_counts():
+    for status in ("queued", "running"):
+        _counts[status] = await jobs.count_documents({"status": status})
+    return dict(_counts)
+
+def counts():
+    """Last known number of queued/running jobs across all workers (see refresh_counts)."""
+    return dict(_counts)
+
+async def ensure_indexes():
+    await jobs.create_index("active_key", unique=True, sparse=True)
+    await jobs.create_index("user_slot", unique=True, sparse=True)
+    await jobs.create_index([("status", 1), ("priority", 1), ("created", 1)])
+    await jobs.create_index([("status", 1), ("lease_until", 1)])
+    if Config.JOB_RETENTION_DAYS:
+        try:
+            await jobs.create_index("finished", expireAfterSeconds=Config.JOB_RETENTION_DAYS * 86400)
+        except OperationFailure:
+            logger.warning("jobs.finished index exists with other options; drop it to change JOB_RETENTION_DAYS")
@@ -0,0 +1,416 @@
+import os
+import asyncio
+import logging
+from datetime import datetime
+from config import Config
+from database import get_user, log_action, refund_quota
+from helper import split_ranges, remove_files
+from shortener import shorten
+from compressor import compress
+from tmpstore import TempSpace, SpaceError
+from progress import Progress, BatchProgress
+import results
+import jobqueue
+import transfer
+import probe
+import metrics
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# temp disk of this host; every worker process needs its own TMP_DIR
+tmp_space = TempSpace(Config.TMP_DIR, Config.TMP_BUDGET_MB * 1024 * 1024, Config.TMP_MIN_FREE_MB * 1024 * 1024)
+
+class Job:
+    """
+    A claimed job document while a worker runs it. `space` is the job's
+    tmpstore.Reservation; the worker releases it (and every temp file
+    tracked there) when the job ends. `state` is what an earlier,
+    interrupted run of the job persisted (see jobqueue.save_state).
+    """
+
+    def __init__(self, doc):
+        self.id = doc["_id"]
+        self.key = doc["key"]
+        self.user_id = doc["user_id"]
+        self.op = doc["op"]
+        self.payload = doc["payload"]
+        self.created = doc["created"]
+        self.quota = doc.get("quota", 1)  # quota slots still held; refunded if the job does not deliver
+        self.state = doc.get("state") or {}
+        self.worker_id = doc.get("worker")  # lease owner
+        self.worker_name = None             # stable name of the worker, recorded with saved state
+        self.space = None
+        self.status_msg = None
+        self.cancelled = False  # set when the user pressed cancel
+        self.lost = False       # set when another worker took over the lease
+        self.released = False   # set when handed back to the queue to resume later
+
+    async def save(self, **fields):
+        self.state.update(fields)
+        await jobqueue.save_state(self.id, self.worker_id, self.worker_name, **fields)
+
+    async def add_sent(self, entry):
+        self.state.setdefault("sent", []).append(entry)
+        await jobqueue.add_sent(self.id, self.worker_id, entry)
+
+# Background tasks that must not delay the job (kept referenced until done)
+_background = set()
+
+def spawn(coro):
+    task = asyncio.create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return task
+
+# Build a share link for an uploaded message and reply with its short form
+async def send_short_link(message, sent):
+    try:
+        link = f"https://t.me/{Config.BOT_USERNAME}/{sent.id}"
+        short = await shorten(link)
+        await message.reply_text(f"🔗 Short link: {short}")
+    except Exception:
+        pass
+
+# Transfers with live progress on the job's status message
+async def download(client, job, file_msg, path, label):
+    media = file_msg.document or file_msg.video or file_msg.audio or file_msg.photo
+    prog = Progress(job.status_msg, label, "download", job.user_id)
+    async with timed("download"):
+        await transfer.download(client, file_msg, path, getattr(media, "file_size", 0), progress=prog.update)
+    await prog.done()
+    return path
+
+async def upload_parts(client, job, label, chat_id, parts, captions, on_sent=None):
+    prog = Progress(job.status_msg, label, "upload", job.user_id)
+    async with timed("upload"):
+        sent = await transfer.send_parts(client, chat_id, parts, captions, progress=prog.update, on_sent=on_sent)
+    await prog.done()
+    return sent
+
+async def upload(client, job, label, method="send_document", **kwargs):
+    prog = Progress(job.status_msg, label, "upload", job.user_id)
+    async with timed("upload"):
+        sent = await getattr(client, method)(progress=prog.update, **kwargs)
+    await prog.done()
+    return sent
+
+# The user's thumb lives in THUMB_DIR of the bot host; other hosts fetch it by file_id
+async def user_thumb(client, job, udoc):
+    thumb = udoc.get("thumb")
+    if thumb and os.path.exists(thumb):
+        return thumb
+    if udoc.get("thumb_id"):
+        try:
+            return await client.download_media(udoc["thumb_id"], file_name=job.space.path("user_thumb.jpg"))
+        except Exception:
+            logger.warning("Could not fetch thumb of user %s", job.user_id)
+    return None
+
+def _entry(msg, part=0):
+    media = msg.document or msg.video or msg.audio
+    return {"part": part, "message_id": msg.id, "file_id": media.file_id if media else None, "caption": msg.caption}
+
+# Download the source unless an interrupted run of this job already left the complete file here
+async def fetch_source(client, job, file_msg, media, path, label):
+    size = getattr(media, "file_size", 0) or 0
+    if job.state.get("downloaded") == path and os.path.exists(path) and os.path.getsize(path) == size:
+        return path
+    await download(client, job, file_msg, path, label)
+    await job.save(downloaded=path)
+    return path
+
+# Send parts in order, starting after the ones an interrupted run already sent; every part
+# is persisted as it goes out. Returns the entries of all parts.
+async def send_resumable(client, job, message, parts, label):
+    captions = [f"Part {i}/{len(parts)}" for i in range(1, len(parts)+1)]
+    done = list(job.state.get("sent", []))
+    if job.state.get("parts") != len(parts):
+        # first run, or the settings changed since: nothing earlier can be reused
+        done = []
+        await job.save(parts=len(parts), sent=[])
+    elif done:
+        await message.reply_text(f"♻️ Resuming: {len(done)}/{len(parts)} parts were already sent.")
+    start = len(done)
+
+    async def on_sent(i, m):
+        entry = _entry(m, start + i)
+        done.append(entry)
+        await job.add_sent(entry)
+
+    if start < len(parts):
+        await upload_parts(client, job, label, message.chat.id, parts[start:], captions[start:], on_sent)
+    return done
+
+# Compress flow: zip the file off-loop straight into upload-sized volumes
+async def do_compress(client, job, message, file_msg, media):
+    status = job.status_msg = await message.reply_text("⏳ Compressing: downloading file...")
+    zip_path = job.space.path(f"{file_msg.id}.zip")
+    volumes = job.state.get("volumes")
+    if volumes and all(os.path.exists(v) for v in volumes):
+        # an interrupted run already produced the archive
+        for v in volumes:
+            job.space.track(v)
+    else:
+        # download
+        local = job.space.path(f"{file_msg.id}_orig")
+        await fetch_source(client, job, file_msg, media, local, "⏳ Compressing: downloading file...")
+        arcname = getattr(media, "file_name", None) or f"file_{file_msg.id}"
+        await status.edit("⏳ Compressing...")
+        async with timed("compress"):
+            volumes, _ = await compress(local, zip_path, arcname)
+        for v in volumes:
+            job.space.track(v)
+        await job.save(volumes=volumes)
+    if len(volumes) == 1:
+        if not job.state.get("sent"):
+            sent = await upload(client, job, "⬆️ Uploading archive...", chat_id=message.chat.id, document=zip_path, caption=f"🗜 Compressed: {os.path.basename(zip_path)}")
+            await job.add_sent(_entry(sent))
+            # generate short link to message (works if bot message visible public)
+            spawn(send_short_link(message, sent))
+        sent = job.state["sent"]
+        await log_action({"user": job.user_id, "action":"compress", "file": os.path.basename(zip_path)})
+    else:
+        await message.reply_text(f"✂ Sending {len(volumes)} parts...")
+        sent = await send_resumable(client, job, message, volumes, f"⬆️ Uploading {len(volumes)} parts...")
+        await log_action({"user": job.user_id, "action":"compress_split", "file": os.path.basename(zip_path), "parts": len(volumes)})
+    await results.save(media.file_unique_id, "compress", sent)
+    await status.delete()
+    return sent
+
+# Split flow: cut the file into SPLIT_SIZE_MB parts and send them in order
+async def do_split(client, job, message, file_msg, media):
+    status = job.status_msg = await message.reply_text("✂ Splitting: downloading file...")
+    local = job.space.path(f"{file_msg.id}_orig")
+    await fetch_source(client, job, file_msg, media, local, "✂ Splitting: downloading file...")
+    # parts are byte-range views over the download, nothing is copied to TMP_DIR
+    parts = split_ranges(local, Config.SPLIT_SIZE_MB*1024*1024)
+    try:
+        sent = await send_resumable(client, job, message, parts, f"⬆️ Uploading {len(parts)} parts...")
+    finally:
+        for p in parts:
+            p.close()
+    await results.save(media.file_unique_id, "split", sent)
+    await log_action({"user": job.user_id, "action":"split", "file": os.path.basename(local), "parts": len(parts)})
+    await status.delete()
+    return sent
+
+# Upload a downloaded file under its new name: as video/audio when the new name says so
+# and the container really is media, otherwise as a document
+async def send_renamed(client, job, chat_id, media, local_path, final_name, caption, thumb, progress):
+    kind = probe.kind_of(final_name)
+    info = None
+    if kind:
+        async with timed("probe"):
+            info = probe.from_media(media) or await probe.probe(local_path, key=media.file_unique_id)
+    async with timed("upload"):
+        if info and info.get("kind") == kind == "video":
+            if not thumb:
+                thumb = await probe.video_thumb(client, media, local_path, info.get("duration"), job.space.track(f"{local_path}.thumb.jpg"))
+            return await client.send_video(chat_id=chat_id, video=local_path, file_name=final_name, caption=caption, thumb=thumb, progress=progress,
+                                           duration=info.get("duration") or 0, width=info.get("width") or 0, height=info.get("height") or 0, supports_streaming=True)
+        if info and info.get("kind") == kind == "audio":
+            return await client.send_audio(chat_id=chat_id, audio=local_path, file_name=final_name, caption=caption, thumb=thumb, progress=progress,
+                                           duration=info.get("duration") or 0, title=info.get("title"), performer=info.get("author"))
+        return await client.send_document(chat_id=chat_id, document=local_path, file_name=final_name, caption=caption, thumb=thumb, progress=progress)
+
+# Renames skip the disk when nothing needs the local file: the size is known and, for a
+# video/audio name, Telegram already has the attributes (no header probe or ffmpeg thumb)
+def can_stream(media, final_name):
+    if not Config.STREAM_RENAME or not getattr(media, "file_size", 0):
+        return False
+    return not probe.kind_of(final_name) or probe.from_media(media) is not None
+
+# Upload the file under its new name while it downloads (see transfer.stream_upload)
+async def stream_renamed(client, job, chat_id, file_msg, media, final_name, caption, thumb, progress):
+    kind = probe.kind_of(final_name)
+    info = probe.from_media(media) if kind else None
+    if not info or info.get("kind") != kind:
+        info = None
+    elif kind == "video" and not thumb:
+        thumb = await probe.video_thumb(client, media, None, None, job.space.path("thumb.jpg"))
+    async with timed("stream"):
+        input_file = await transfer.stream_upload(client, file_msg, media.file_size, final_name, progress)
+        return await transfer.send_file(client, chat_id, input_file, final_name, caption, info, thumb)
+
+# Rename flow: re-upload the file under the new name with the user's thumb/caption
+async def do_rename(client, job, message, file_msg, media, final_name):
+    if job.state.get("sent"):
+        # an interrupted run already delivered the file
+        return job.state["sent"]
+    stream = can_stream(media, final_name)
+    progress_msg = job.status_msg = await message.reply_text("🔁 Renaming..." if stream else "⬇️ Downloading...")
+    if not stream:
+        local_path = job.space.path(final_name)
+        await fetch_source(client, job, file_msg, media, local_path, "⬇️ Downloading...")
+    # straight from Mongo: the bot process may have changed the thumb/caption since this worker cached them
+    udoc = await get_user(job.user_id, fresh=True) or {}
+    # load user thumb if exists
+    thumb = await user_thumb(client, job, udoc)
+    # caption
+    saved_caption = udoc.get("caption")
+    caption_text = saved_caption or f"✅ Renamed: {final_name}"
+    if stream:
+        prog = Progress(job.status_msg, "🔁 Renaming...", "upload", job.user_id)
+        sent = await stream_renamed(client, job, message.chat.id, file_msg, media, final_name, caption_text, thumb, prog.update)
+    else:
+        prog = Progress(job.status_msg, "⬆️ Uploading renamed file...", "upload", job.user_id)
+        sent = await send_renamed(client, job, message.chat.id, media, local_path, final_name, caption_text, thumb, prog.update)
+    await prog.done()
+    await job.add_sent(_entry(sent))
+    # log
+    await log_action({"user": job.user_id, "action":"rename", "new_name": final_name, "size": media.file_size if stream else os.path.getsize(local_path)})
+    # build a share link and shorten it in the background
+    spawn(send_short_link(message, sent))
+
+    await progress_msg.delete()
+    return job.state["sent"]
+
+def _media(msg):
+    return msg and not msg.empty and (msg.document or msg.video or msg.audio or msg.photo)
+
+# Batch flow: rename many files as a pipeline. A fetcher downloads up to BATCH_PREFETCH files
+# ahead while the uploader sends them in order, deleting each file once it is sent.
+# Files an interrupted run already sent are skipped.
+async def do_batch(client, job, message, file_msgs, names):
+    sent = list(job.state.get("sent", []))
+    done = {e["part"] for e in sent}
+    # their quota slots are spent for good
+    job.quota -= len(done)
+    items = [(i, m, _media(m), name) for i, (m, name) in enumerate(zip(file_msgs, names)) if i not in done]
+    failed = [name for _, _, media, name in items if not media]
+    items = [it for it in items if it[2]]
+    # straight from Mongo: the bot process may have changed the thumb/caption since this worker cached them
+    udoc = await get_user(job.user_id, fresh=True) or {}
+    thumb = await user_thumb(client, job, udoc)
+    if done:
+        await message.reply_text(f"♻️ Resuming: {len(done)} files were already sent.")
+    status = job.status_msg = await message.reply_text(f"📦 Batch: 0/{len(items)} sent")
+    prog = BatchProgress(status, len(items), sum(getattr(media, "file_size", 0) or 0 for _, _, media, _ in items), job.user_id)
+    prog.failed = len(failed)
+    ready = asyncio.Queue(Config.BATCH_PREFETCH)
+
+    async def fetch():
+        for i, file_msg, media, name in items:
+            part = prog.part(i, "download")
+            try:
+                path = job.space.path(f"{i:04d}_{name}")
+                async with timed("download"):
+                    await transfer.download(client, file_msg, path, getattr(media, "file_size", 0), progress=part.update)
+                await part.done()
+            except Exception:
+                logger.exception("Batch download of %s failed", name)
+                path = None
+            await ready.put((i, media, name, path))
+        await ready.put(None)
+
+    fetcher = asyncio.create_task(fetch())
+    try:
+        while (item := await ready.get()) is not None:
+            i, media, name, path = item
+            try:
+                if path is None:
+                    raise FileNotFoundError(name)
+                part = prog.part(i, "upload")
+                m = await send_renamed(client, job, message.chat.id, media, path, name, udoc.get("caption") or f"✅ Renamed: {name}", thumb, part.update)
+                await part.done()
+                entry = _entry(m, i)
+                await job.add_sent(entry)
+                sent.append(entry)
+                prog.sent += 1
+                job.quota -= 1
+            except Exception:
+                if path is not None:
+                    logger.exception("Batch upload of %s failed", name)
+                failed.append(name)
+                prog.failed += 1
+            finally:
+                if path is not None:
+                    await remove_files([path])
+    finally:
+        fetcher.cancel()
+    # files that were not delivered give their quota slot back
+    await refund_quota(job.user_id, len(failed))
+    job.quota -= len(failed)
+    await log_action({"user": job.user_id, "action": "batch", "files": len(sent), "failed": len(failed)})
+    text = f"✅ Batch done: {len(sent)} sent"
+    if failed:
+        text += f", {len(failed)} failed (not counted):\n" + "\n".join(failed[:20])
+    await status.edit(text)
+    return sorted(sent, key=lambda e: e["part"])
+
+def _outputs(sent):
+    return [{"message_id": e["message_id"], "file_id": e["file_id"]} for e in sent]
+
+def _on_disk(path):
+    """Bytes already in a job's directory, e.g. left by an interrupted run."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return total
+
+# Runs one claimed job and returns (status, fields) for jobqueue.finish.
+# The quota slot reserved when the job was queued is refunded unless it succeeds.
+async def run_job(client, job):
+    metrics.STAGE_SECONDS.observe((datetime.utcnow() - job.created).total_seconds(), stage="queue_wait")
+    p = job.payload
+    message = None
+    try:
+        # the handler only queued ids; fetch the messages on this worker's own client
+        file_ids = [f[0] for f in p["files"]] if job.op == "batch" else [p["file_message_id"]]
+        message, *file_msgs = await client.get_messages(p["chat_id"], [p["message_id"]] + file_ids)
+        media = next((m for m in map(_media, file_msgs) if m), None)
+        if not media:
+            await refund_quota(job.user_id, job.quota)
+            if message and not message.empty:
+                await message.reply_text("❌ The file is no longer available.")
+            return "failed", {"error": "file message gone"}
+        # reserve temp disk before downloading: the file, plus the archive when compressing;
+        # a batch holds at most the files being downloaded ahead plus the one uploading
+        need = (getattr(media, "file_size", 0) or 0) * (2 if job.op == "compress" else 1)
+        if job.op == "rename" and can_stream(media, p["name"]):
+            need = 0
+        elif job.op == "batch":
+            need = max(getattr(_media(m), "file_size", 0) or 0 for m in file_msgs) * (Config.BATCH_PREFETCH + 2)
+        # files kept from an interrupted run already occupy part of that
+        need = max(0, need - _on_disk(tmp_space.dir_for(job.key)))
+        waiting = None
+        if tmp_space.would_wait(need):
+            waiting = await message.reply_text("⏳ Waiting for free disk space...")
+        async with timed("tmp_wait"):
+            job.space = await tmp_space.reserve(job.key, need, timeout=Config.TMP_WAIT)
+        if waiting:
+            await waiting.delete()
+        if job.op == "batch":
+            sent = await do_batch(client, job, message, file_msgs, [f[1] for f in p["files"]])
+        elif job.op == "compress":
+            sent = await do_compress(client, job, message, file_msgs[0], media)
+        elif job.op == "split":
+            sent = await do_split(client, job, message, file_msgs[0], media)
+        else:
+            sent = await do_rename(client, job, message, file_msgs[0], media, p["name"])
+        return "done", {"result": _outputs(sent)}
+    except asyncio.CancelledError:
+        # shutdown or a lost lease hands the job to another worker; only a user cancel ends it
+        if job.cancelled:
+            await refund_quota(job.user_id, job.quota)
+            try:
+                if job.status_msg:
+                    await job.status_msg.edit("❌ Cancelled.")
+            except Exception:
+                pass
+        raise
+    except SpaceError:
+        await refund_quota(job.user_id, job.quota)
+        await message.reply_text("🚫 Not enough temporary disk space for this file right now. Please try again later.")
+        return "failed", {"error": "no temp space"}
+    except Exception as e:
+        logger.exception("Job failed for user %s", job.user_id)
+        await refund_quota(job.user_id, job.quota)
+        if message:
+            await message.reply_text("❌ Operation failed. It was not counted against your daily limit.")
+        return "failed", {"error": repr(e)}
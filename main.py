@@ -2,23 +2,30 @@ import os
 import asyncio
 import math
 import time
+STARTED = time.monotonic()  # for the startup report
 from datetime import datetime
-from pyrogram import Client, filters, enums
+from pyrogram import Client, filters, enums, idle
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from config import Config
 from database import *
 from helper import *
-from shortener import shorten
+from shortener import close as close_shortener, cache_stats as shortener_cache_stats
+from jobqueue import PRIORITY_HIGH, PRIORITY_NORMAL
+from broadcast import new_broadcast, resume_broadcasts, broadcast_status
+from bson import ObjectId
+import nsfw
+import results
+from progress import throughput
+import probe
+import jobqueue
+import membership
+import batch
+import jobs
+from worker import Worker
+import metrics
+from metrics import timed, instrument, Gauge
 import logging
-
-# Optional NSFW classifier
-NSFW_CLASSIFIER = None
-if Config.USE_NSFW:
-    try:
-        from nudenet import NudeClassifier
-        NSFW_CLASSIFIER = NudeClassifier()
-    except Exception:
-        NSFW_CLASSIFIER = None
+import humanize
 
 # ensure dirs
 ensure_dirs()
@@ -27,10 +34,24 @@ ensure_dirs()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# admission control and artifact tracking for TMP_DIR (used by the embedded worker)
+tmp_space = jobs.tmp_space
+
+# metrics read at scrape time
+CACHES = {"users": cache_stats, "shortener": shortener_cache_stats, "nsfw": nsfw.cache_stats, "results": results.stats, "probe": probe.cache_stats, "membership": membership.cache_stats}
+Gauge("bot_jobs_queued", "Jobs waiting for a worker", lambda: jobqueue.counts().get("queued", 0))
+Gauge("bot_jobs_running", "Jobs being processed", lambda: jobqueue.counts().get("running", 0))
+Gauge("bot_tmp_reserved_bytes", "Temp disk reserved by running jobs", tmp_space.reserved)
+Gauge("bot_nsfw_queue_depth", "Previews waiting for the NSFW worker", lambda: nsfw.service.stats()["queue_depth"])
+Gauge("bot_cache_hits", "Cache hits by cache", metrics.cache_gauge("hits", CACHES))
+Gauge("bot_cache_misses", "Cache misses by cache", metrics.cache_gauge("misses", CACHES))
+Gauge("bot_throughput_bytes_per_second", "Average transfer speed by direction", lambda: {(("direction", d),): v for d, v in throughput().items()})
+
 app = Client("rename_bot",
              api_id=Config.API_ID,
              api_hash=Config.API_HASH,
              bot_token=Config.BOT_TOKEN,
+             max_concurrent_transmissions=Config.MAX_TRANSMISSIONS,
              workdir=".")
 
 # Inline buttons used across flows
@@ -44,30 +65,27 @@ def main_buttons():
          InlineKeyboardButton("❌ Cancel", callback_data="act_cancel")]
     ])
 
-# Force-subscribe check
+# Force-subscribe check (membership answers are cached, see membership.py)
 async def force_sub_check(msg):
     if not Config.FS_CHANNEL_ID:
         return False
-    try:
-        member = await app.get_chat_member(Config.FS_CHANNEL_ID, msg.from_user.id)
-        if member.status in (enums.ChatMemberStatus.MEMBER, enums.ChatMemberStatus.ADMINISTRATOR, enums.ChatMemberStatus.OWNER):
-            return False
-    except Exception:
-        pass
+    if await membership.is_member(app, msg.from_user.id):
+        return False
     # send join prompt
-    try:
-        chat = await app.get_chat(Config.FS_CHANNEL_ID)
-        url = f"https://t.me/{chat.username}" if chat.username else f"https://t.me/c/{str(Config.FS_CHANNEL_ID)[4:]}"
-    except Exception:
-        url = "https://t.me/{}".format(Config.FS_CHANNEL_ID)
+    url = await membership.channel_url(app)
     await msg.reply_text("⚠️ Please join our channel to use this bot.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Join Channel", url=url)]]))
     return True
 
+# Joins/leaves in the force-sub channel refresh the membership cache (needs the bot to be a channel admin)
+@app.on_chat_member_updated(filters.chat(Config.FS_CHANNEL_ID))
+async def fs_member_updated(_, event):
+    membership.update(event)
+
 # START
 @app.on_message(filters.private & filters.command("start"))
 async def start_handler(_, message):
     if await force_sub_check(message): return
-    ensure_user(message.from_user.id)
+    await ensure_user(message.from_user.id)
     await message.reply_text(
         "👋 Send a file and choose an action.\n"
         "Use /me to view quota. Admins use /broadcast, /setlimit, /promote, /demote.",
@@ -80,8 +98,11 @@ async def help_cb(_, callback):
         "Send a file → choose action: Rename / Compress / Split / Set Thumb / Save Caption.\n"
         "Commands:\n"
         "/me - show quota\n"
+        "/batch <template> [| regex] - rename many files, then /done\n"
         "/setlimit <id> <limit> - (admin)\n"
         "/broadcast <message> - (admin)\n"
+        "/bstatus [id] - broadcast progress (admin)\n"
+        "/stats - bot metrics (admin)\n"
         "/promote <id> - (admin)\n"
         "/demote <id> - (admin)\n"
     )
@@ -94,29 +115,44 @@ async def ask_thumbnail(_, message):
 
 @app.on_message(filters.private & filters.photo)
 async def save_thumb(_, message):
+    # photos sent during a /batch are batch files, not a new thumbnail
+    if batch.get(message.from_user.id):
+        return await file_handler(_, message)
     # Save per-user thumb
-    ensure_user(message.from_user.id)
+    await ensure_user(message.from_user.id)
     path = os.path.join(Config.THUMB_DIR, f"{message.from_user.id}.jpg")
-    await app.download_media(message.photo.file_id, file_name=path)
-    set_thumb(message.from_user.id, path)
+    # download_media resolves a relative THUMB_DIR against the script's folder; keep the path it used
+    path = await app.download_media(message.photo.file_id, file_name=path)
+    await set_thumb(message.from_user.id, path, message.photo.file_id)
     await message.reply_text("✅ Thumbnail saved.")
 
 # When a file arrives, show inline menu (reply)
 @app.on_message(filters.private & (filters.document | filters.video | filters.audio | filters.photo))
 async def file_handler(_, message):
     if await force_sub_check(message): return
-    ensure_user(message.from_user.id)
+    await ensure_user(message.from_user.id)
+    # while a /batch is open, files (and media groups) are collected instead of getting a menu
+    b = batch.get(message.from_user.id)
+    if b:
+        if len(b.files) >= Config.BATCH_MAX_FILES:
+            return await message.reply_text(f"📦 A batch holds at most {Config.BATCH_MAX_FILES} files. Send /done.")
+        n = b.add(message)
+        if b.due_edit():
+            try:
+                await b.status_msg.edit(f"📥 {n} files collected. Send more, then /done (or /cancel).")
+            except Exception:
+                pass
+        return
     # optional extension filter (not implemented here)
     await message.reply_text("Choose an action for this file:", reply_markup=main_buttons(), quote=True)
 
 # Callback handler to route actions
 @app.on_callback_query()
+@instrument("callback_router")
 async def callback_router(_, callback):
     data = callback.data
     user_id = callback.from_user.id
-    ensure_user(user_id)
-    udoc = users.find_one({"_id": user_id})
-    reset_if_needed(udoc)
+    udoc = await ensure_user(user_id)
 
     # must be reply to a file message
     if not callback.message.reply_to_message:
@@ -131,6 +167,10 @@ async def callback_router(_, callback):
 
     # cancel
     if data == "act_cancel":
+        # abort the queued/running job for this file; a running one stops at its worker's next heartbeat
+        job = await jobqueue.cancel(jobqueue.job_key(callback.message.chat.id, file_msg.id))
+        if job and job["status"] == "queued":
+            await refund_quota(user_id, job.get("quota", 1))
         await callback.message.edit("Cancelled.")
         await callback.answer()
         return
@@ -149,9 +189,7 @@ async def callback_router(_, callback):
 
     # For operations that produce an upload, check daily limit (unless admin or premium)
     if data in ("act_rename","act_compress","act_split"):
-        udoc = users.find_one({"_id": user_id})
-        reset_if_needed(udoc)
-        if udoc.get("daily_count",0) >= udoc.get("limit", Config.DEFAULT_DAILY_LIMIT) and not udoc.get("is_admin", False) and not udoc.get("premium", False):
+        if not has_quota(udoc):
             await callback.answer("🚫 Daily limit reached. Ask admin to increase your limit or purchase premium.", show_alert=True)
             return
 
@@ -175,45 +213,27 @@ async def callback_router(_, callback):
 
     await callback.answer()
 
-# Helper: quick NSFW check
+# Helper: quick NSFW check (scanned out of process, verdicts cached by file_unique_id)
 async def is_safe_media(file_msg):
-    if not Config.USE_NSFW:
-        return True
-    # Basic filename filter
-    fname = getattr(file_msg, "document", None) and file_msg.document.file_name or ""
-    if any(k in (fname or "").lower() for k in ("porn","xxx","adult","nsfw")):
+    return await nsfw.is_safe(app, file_msg)
+
+# Answer from the result index without downloading or uploading anything
+async def resend_cached(message, media, op):
+    docs = await results.lookup(media.file_unique_id, op)
+    if not docs:
         return False
-    # If NSFW classifier available, try visual check for photos or thumbnails
-    if NSFW_CLASSIFIER:
-        try:
-            preview = None
-            if file_msg.photo:
-                preview = await app.download_media(file_msg.photo.file_id, file_name=os.path.join(Config.TMP_DIR, f"nsfw_{file_msg.message_id}.jpg"))
-            else:
-                thumb = getattr(file_msg, "thumbnail", None)
-                if thumb:
-                    preview = await app.download_media(thumb.file_id, file_name=os.path.join(Config.TMP_DIR, f"nsfw_{file_msg.message_id}.jpg"))
-            if preview:
-                res = NSFW_CLASSIFIER.classify(preview)
-                # nudenet returns dict path->{'safe':p, 'unsafe':q} or similar
-                for r in res.values():
-                    if isinstance(r, dict) and (r.get("unsafe",0) > 0.7 or r.get("porn",0) > 0.7):
-                        try: os.remove(preview)
-                        except: pass
-                        return False
-                try: os.remove(preview)
-                except: pass
-        except Exception:
-            pass
+    for d in docs:
+        await app.send_cached_media(chat_id=message.chat.id, file_id=d["file_id"], caption=d.get("caption"))
+    await log_action({"user": message.from_user.id, "action": op, "parts": len(docs), "cached": True})
     return True
 
 # Text replies handler: receives rename/compress/split/caption saving commands as replies
 @app.on_message(filters.private & filters.text & filters.reply)
+@instrument("text_reply")
 async def text_reply(_, message):
-    if await force_sub_check(message): return
-    ensure_user(message.from_user.id)
-    udoc = users.find_one({"_id": message.from_user.id})
-    reset_if_needed(udoc)
+    async with timed("force_sub"):
+        if await force_sub_check(message): return
+    await ensure_user(message.from_user.id)
 
     txt = message.text.strip()
     replied = message.reply_to_message
@@ -222,12 +242,14 @@ async def text_reply(_, message):
     if not media:
         # may be saving caption when replying to bot prompt
         if message.text and message.reply_to_message and "save as your default caption" in message.reply_to_message.text.lower():
-            set_caption(message.from_user.id, message.text)
+            await set_caption(message.from_user.id, message.text)
             await message.reply_text("✅ Default caption saved.")
         return
 
     # NSFW check
-    if not await is_safe_media(file_msg):
+    async with timed("nsfw"):
+        safe = await is_safe_media(file_msg)
+    if not safe:
         await message.reply_text("🚫 File flagged NSFW. Operation aborted.")
         return
 
@@ -238,122 +260,103 @@ async def text_reply(_, message):
     else:
         ext = os.path.splitext(getattr(media, "file_name", "") or "")[1]
 
-    # If user typed 'compress' or 'split', run those flows
-    if txt.lower() == "compress":
-        status = await message.reply_text("⏳ Compressing: downloading file...")
-        # download
-        local = await app.download_media(file_msg, file_name=os.path.join(Config.TMP_DIR, f"{file_msg.message_id}_orig"))
-        zip_path = os.path.join(Config.TMP_DIR, f"{file_msg.message_id}.zip")
-        try:
-            from helper import zip_file
-            zip_file(local, zip_path)
-        except Exception:
-            # fallback manual zip
-            import zipfile
-            with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-                arcname = getattr(media,"file_name", f"file_{file_msg.message_id}")
-                zf.write(local, arcname=arcname)
-        size_mb = os.path.getsize(zip_path)/(1024*1024)
-        if size_mb <= Config.MAX_UPLOAD_MB:
-            sent = await app.send_document(chat_id=message.chat.id, document=zip_path, caption=f"🗜 Compressed: {os.path.basename(zip_path)}")
-            increment_count(message.from_user.id)
-            log_action({"user": message.from_user.id, "action":"compress", "file": os.path.basename(zip_path)})
-            # generate short link to message (works if bot message visible public)
-            try:
-                link = f"https://t.me/{Config.BOT_USERNAME}/{sent.message_id}"
-                short = shorten(link)
-                await message.reply_text(f"🔗 Short link: {short}")
-            except Exception:
-                pass
-            await status.delete()
-            # cleanup
-            try: os.remove(local)
-            except: pass
-            try: os.remove(zip_path)
-            except: pass
-            return
-        else:
-            # split zip
-            parts = split_file(zip_path, Config.SPLIT_SIZE_MB*1024*1024)
-            await message.reply_text(f"✂ Sending {len(parts)} parts...")
-            for i,p in enumerate(parts, start=1):
-                await app.send_document(chat_id=message.chat.id, document=p, caption=f"Part {i}/{len(parts)}")
-                await asyncio.sleep(0.6)
-            increment_count(message.from_user.id)
-            log_action({"user": message.from_user.id, "action":"compress_split", "file": os.path.basename(zip_path), "parts": len(parts)})
-            await status.delete()
-            # cleanup
-            for f in parts:
-                try: os.remove(f)
-                except: pass
-            try: os.remove(local)
-            except: pass
-            try: os.remove(zip_path)
-            except: pass
-            return
-
-    if txt.lower() == "split":
-        status = await message.reply_text("✂ Splitting: downloading file...")
-        local = await app.download_media(file_msg, file_name=os.path.join(Config.TMP_DIR, f"{file_msg.message_id}_orig"))
-        parts = split_file(local, Config.SPLIT_SIZE_MB*1024*1024)
-        for i,p in enumerate(parts, start=1):
-            await app.send_document(chat_id=message.chat.id, document=p, caption=f"Part {i}/{len(parts)}")
-            await asyncio.sleep(0.6)
-        increment_count(message.from_user.id)
-        log_action({"user": message.from_user.id, "action":"split", "file": os.path.basename(local), "parts": len(parts)})
-        await status.delete()
-        # cleanup
-        for f in parts:
-            try: os.remove(f)
-            except: pass
-        try: os.remove(local)
-        except: pass
+    # Reserve a quota slot up front; it is refunded if the job fails
+    udoc = await reserve_quota(message.from_user.id)
+    if not udoc:
+        await message.reply_text("🚫 Daily limit reached. Ask admin to increase your limit or purchase premium.")
         return
 
-    # Otherwise treat text as rename filename
-    new_name = message.text.strip()
-    final_name = f"{new_name}{ext}"
-    progress_msg = await message.reply_text("⬇️ Downloading...")
-    local_path = await app.download_media(file_msg, file_name=os.path.join(Config.TMP_DIR, final_name))
-    await progress_msg.edit("⬆️ Uploading renamed file...")
-    # load user thumb if exists
-    udoc = users.find_one({"_id": message.from_user.id})
-    thumb = udoc.get("thumb") if udoc else None
-    # caption
-    saved_caption = udoc.get("caption") if udoc else None
-    caption_text = saved_caption or f"✅ Renamed: {final_name}"
-    # srt hint: if .srt rename to keep same basename but .srt extension handling
-    if final_name.lower().endswith(".srt"):
-        # send as document preserving name
-        sent = await app.send_document(chat_id=message.chat.id, document=local_path, caption=caption_text, thumb=thumb)
-    else:
-        sent = await app.send_document(chat_id=message.chat.id, document=local_path, caption=caption_text, thumb=thumb)
-    # increment and log
-    increment_count(message.from_user.id)
-    log_action({"user": message.from_user.id, "action":"rename", "new_name": final_name, "size": os.path.getsize(local_path)})
-    # build a share link and shorten it
-    try:
-        link = f"https://t.me/{Config.BOT_USERNAME}/{sent.message_id}"
-        short = shorten(link)
+    # Repeat compress/split of a known file: re-send the earlier outputs by file_id
+    op = txt.lower()
+    if op in ("compress", "split"):
         try:
-            await message.reply_text(f"🔗 Short link: {short}")
-        except:
-            pass
-    except Exception:
-        pass
-
-    await progress_msg.delete()
+            async with timed("cached_resend"):
+                if await resend_cached(message, media, op):
+                    return
+        except Exception:
+            logger.exception("Cached resend failed for %s", media.file_unique_id)
+            await results.forget(media.file_unique_id, op)
+
+    # Queue the heavy work for a worker; premium/admin users get the fast lane
+    priority = PRIORITY_HIGH if udoc.get("premium") or udoc.get("is_admin") else PRIORITY_NORMAL
+    payload = {"chat_id": message.chat.id, "message_id": message.id, "file_message_id": file_msg.id}
+    if op not in ("compress", "split"):
+        op = "rename"
+        payload["name"] = f"{txt}{ext}"
+    pos = await jobqueue.enqueue(jobqueue.job_key(message.chat.id, file_msg.id), message.from_user.id, op, payload, priority)
+    if pos is None:
+        await refund_quota(message.from_user.id)
+        await message.reply_text("⏳ This file is already being processed.")
+    elif pos:
+        await message.reply_text(f"🕒 Queued at position {pos + 1}. Press ❌ Cancel on the file menu to abort.")
+
+# Batch rename: /batch <template> [| regex], then files, then /done
+@app.on_message(filters.private & filters.command("batch"))
+async def cmd_batch(_, message):
+    if await force_sub_check(message): return
+    await ensure_user(message.from_user.id)
     try:
-        os.remove(local_path)
-    except:
-        pass
+        b = batch.parse(message.text.partition(" ")[2])
+    except ValueError as e:
+        return await message.reply_text(str(e))
+    b.status_msg = await message.reply_text("📦 Batch started. Send the files (albums work too), then /done. /cancel aborts.")
+    batch.start(message.from_user.id, b)
+
+@app.on_message(filters.private & filters.command("done"))
+@instrument("batch_done")
+async def cmd_done(_, message):
+    uid = message.from_user.id
+    b = batch.pop(uid)
+    if not b or not b.files:
+        return await message.reply_text("No files collected. Start with /batch <template>.")
+    try:
+        names = b.names()
+    except Exception as e:
+        # keep the collected files whatever went wrong naming them
+        batch.start(uid, b)
+        return await message.reply_text(f"{e}\nFix it with /cancel and a new /batch.")
+    files = sorted(b.files, key=lambda m: m.id)
+    safe = await asyncio.gather(*(is_safe_media(m) for m in files))
+    picked = [(m.id, name) for m, name, ok in zip(files, names, safe) if ok]
+    if len(picked) < len(files):
+        await message.reply_text(f"🚫 {len(files) - len(picked)} files flagged NSFW were left out.")
+    # one quota slot per file; files beyond the remaining quota are left out
+    udoc = None
+    for i in range(len(picked)):
+        u = await reserve_quota(uid)
+        if not u:
+            picked = picked[:i]
+            await message.reply_text(f"🚫 Daily limit reached: only the first {i} files will be renamed.")
+            break
+        udoc = u
+    if not picked:
+        return
+    priority = PRIORITY_HIGH if udoc.get("premium") or udoc.get("is_admin") else PRIORITY_NORMAL
+    payload = {"chat_id": message.chat.id, "message_id": message.id, "files": picked}
+    pos = await jobqueue.enqueue(f"batch:{uid}", uid, "batch", payload, priority, quota=len(picked))
+    if pos is None:
+        await refund_quota(uid, len(picked))
+        await message.reply_text("⏳ Your previous batch is still running.")
+    else:
+        await message.reply_text(f"📦 {len(picked)} files queued" + (f" at position {pos + 1}" if pos else "") + ". /cancel aborts.")
+
+@app.on_message(filters.private & filters.command("cancel"))
+async def cmd_cancel(_, message):
+    uid = message.from_user.id
+    if batch.pop(uid):
+        return await message.reply_text("Batch discarded.")
+    job = await jobqueue.cancel(f"batch:{uid}")
+    if not job:
+        return await message.reply_text("Nothing to cancel.")
+    if job["status"] == "queued":
+        await refund_quota(uid, job.get("quota", 1))
+    await message.reply_text("Cancelled.")
 
 # Admin commands
 def admin_only(func):
     async def wrapper(_, message):
         uid = message.from_user.id
-        ensure_user(uid)
-        u = users.find_one({"_id": uid})
+        u = await ensure_user(uid)
         if not u.get("is_admin", False):
             return await message.reply_text("🚫 Admins only.")
         return await func(_, message)
@@ -367,8 +370,8 @@ async def cmd_setlimit(_, message):
         target = int(parts[1]); lim = int(parts[2])
     except Exception:
         return await message.reply_text("Usage: /setlimit <user_id> <limit>")
-    ensure_user(target)
-    set_limit(target, lim)
+    await ensure_user(target)
+    await set_limit(target, lim)
     await message.reply_text(f"✅ Set limit for {target} to {lim}.")
 
 @app.on_message(filters.private & filters.command("promote"))
@@ -378,8 +381,8 @@ async def cmd_promote(_, message):
         target = int(message.text.split()[1])
     except:
         return await message.reply_text("Usage: /promote <user_id>")
-    ensure_user(target)
-    set_admin(target, True)
+    await ensure_user(target)
+    await set_admin(target, True)
     await message.reply_text(f"✅ Promoted {target} to admin.")
 
 @app.on_message(filters.private & filters.command("demote"))
@@ -389,7 +392,7 @@ async def cmd_demote(_, message):
         target = int(message.text.split()[1])
     except:
         return await message.reply_text("Usage: /demote <user_id>")
-    set_admin(target, False)
+    await set_admin(target, False)
     await message.reply_text(f"✅ Demoted {target} from admin.")
 
 @app.on_message(filters.private & filters.command("premium"))
@@ -400,7 +403,7 @@ async def cmd_premium(_, message):
         target = int(parts[1]); flag = parts[2].lower() in ("1","true","yes","on")
     except:
         return await message.reply_text("Usage: /premium <user_id> <on/off>")
-    set_premium(target, flag)
+    await set_premium(target, flag)
     await message.reply_text(f"✅ Premium set to {flag} for {target}.")
 
 @app.on_message(filters.private & filters.command("broadcast"))
@@ -410,29 +413,97 @@ async def cmd_broadcast(_, message):
     txt = message.text.partition(" ")[2]
     if not txt:
         return await message.reply_text("Usage: /broadcast <message text>")
-    await message.reply_text("Broadcast started...")
-    count = 0
-    cursor = users.find({}, {"_id":1})
-    for u in cursor:
-        uid = u["_id"]
-        try:
-            await app.send_message(uid, txt)
-            count += 1
-            await asyncio.sleep(0.05)
-        except Exception as e:
-            # skip unreachable
-            await asyncio.sleep(0.05)
-    await message.reply_text(f"Broadcast finished. Sent to {count} users.")
-    log_action({"user": message.from_user.id, "action":"broadcast", "sent": count})
+    # runs in the background with checkpoints in `broadcasts`; survives restarts
+    bid = await new_broadcast(app, message.from_user.id, txt)
+    await message.reply_text(f"Broadcast started. ID: `{bid}`\nUse /bstatus to follow progress.")
+
+@app.on_message(filters.private & filters.command("bstatus"))
+@admin_only
+async def cmd_bstatus(_, message):
+    # usage: /bstatus [broadcast_id]
+    arg = message.text.partition(" ")[2].strip()
+    try:
+        doc = await broadcast_status(ObjectId(arg) if arg else None)
+    except Exception:
+        return await message.reply_text("Usage: /bstatus [broadcast_id]")
+    if not doc:
+        return await message.reply_text("No broadcast found.")
+    await message.reply_text(
+        f"Broadcast `{doc['_id']}`: {doc.get('status')}\n"
+        f"Sent: {doc.get('sent',0)}, failed: {doc.get('failed',0)}, pruned: {doc.get('pruned',0)}"
+    )
+
+@app.on_message(filters.private & filters.command("stats"))
+@admin_only
+async def cmd_stats(_, message):
+    lines = [
+        "📊 Bot stats",
+        "Jobs: {running} running, {queued} queued".format(**await jobqueue.refresh_counts()),
+        f"Temp: {humanize.naturalsize(tmp_space.reserved(), binary=True)} reserved of {humanize.naturalsize(tmp_space.capacity(), binary=True)}",
+        f"NSFW queue: {nsfw.service.stats()['queue_depth']}",
+        f"FloodWaits: {int(sum(metrics.FLOODWAITS.values.values()))}",
+        "Throughput: " + ", ".join(f"{d} {humanize.naturalsize(v, binary=True)}/s" for d, v in throughput().items()),
+        "Caches:",
+    ]
+    for name, stats in CACHES.items():
+        s = stats()
+        lines.append(f"  {name}: {s['hit_rate']*100:.0f}% ({s['hits']} hits / {s['misses']} misses)")
+    lines.append("Stages (count · avg):")
+    for key, (count, avg) in sorted(metrics.STAGE_SECONDS.summary().items()):
+        lines.append(f"  {dict(key)['stage']}: {count} · {avg:.3f}s")
+    await message.reply_text("\n".join(lines))
 
 @app.on_message(filters.private & filters.command("me"))
 async def cmd_me(_, message):
-    ensure_user(message.from_user.id)
-    u = users.find_one({"_id": message.from_user.id})
-    reset_if_needed(u)
-    await message.reply_text(f"Your daily usage: {u.get('daily_count',0)}/{u.get('limit', Config.DEFAULT_DAILY_LIMIT)}\nPremium: {u.get('premium',False)}\nAdmin: {u.get('is_admin',False)}")
+    u = await ensure_user(message.from_user.id)
+    await message.reply_text(f"Your daily usage: {quota_used(u)}/{u.get('limit', Config.DEFAULT_DAILY_LIMIT)}\nPremium: {u.get('premium',False)}\nAdmin: {u.get('is_admin',False)}")
+
+# Work that needs Mongo or the NSFW model runs after the bot already answers
+async def warmup():
+    report = {}
+    try:
+        report["mongo ping"] = await ping_db()
+        t = time.monotonic()
+        await ensure_indexes()
+        await results.ensure_indexes()
+        await jobqueue.ensure_indexes()
+        report["indexes"] = time.monotonic() - t
+        # continue broadcasts interrupted by the last shutdown
+        await resume_broadcasts(app)
+    except Exception:
+        logger.exception("Mongo warmup failed; collections connect on first use")
+    if Config.USE_NSFW:
+        report["nsfw model"] = await nsfw.service.warmup()
+    logger.info("Warmup: %s", ", ".join(f"{k} {v:.2f}s" for k, v in report.items()))
+
+async def main():
+    report = {"imports": time.monotonic() - STARTED}
+    metrics_runner = await metrics.start_server(Config.METRICS_PORT, Config.METRICS_HOST) if Config.METRICS_PORT else None
+    t = time.monotonic()
+    await app.start()
+    report["telegram"] = time.monotonic() - t
+    worker = None
+    if Config.EMBEDDED_WORKER:
+        worker = Worker(app)
+        await worker.start()
+    report["ready"] = time.monotonic() - STARTED
+    metrics.STAGE_SECONDS.observe(report["ready"], stage="startup")
+    logger.info("Startup: %s", ", ".join(f"{k} {v:.2f}s" for k, v in report.items()))
+    warm = asyncio.create_task(warmup())
+    await idle()
+    warm.cancel()
+    if worker:
+        await worker.stop()
+    await app.stop()
+    if metrics_runner:
+        await metrics_runner.cleanup()
+    # flush buffered log documents
+    await close_db()
+    await close_shortener()
+    nsfw.service.close()
+    probe.close()
 
 # Run
 if __name__ == "__main__":
     print("Starting Rename Bot...")
-    app.run()
+    app.run(main())
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+from pyrogram import enums
+from pyrogram.errors import UserNotParticipant
+from config import Config
+from cache import TTLCache
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+JOINED = (enums.ChatMemberStatus.MEMBER, enums.ChatMemberStatus.ADMINISTRATOR, enums.ChatMemberStatus.OWNER)
+
+# user_id -> joined the force-sub channel; non-members are re-checked sooner so joining takes effect quickly
+_members = TTLCache(Config.FS_CACHE_SIZE, Config.FS_MEMBER_TTL)
+_inflight = {}
+_channel_url = None
+
+def cache_stats():
+    return _members.stats()
+
+async def _fetch(client, user_id):
+    try:
+        async with timed("get_chat_member"):
+            member = await client.get_chat_member(Config.FS_CHANNEL_ID, user_id)
+    except UserNotParticipant:
+        joined = False
+    except Exception as e:
+        # not cached: a FloodWait or network error says nothing about the user
+        logger.debug("Membership check for %s failed: %s", user_id, e)
+        return False
+    else:
+        joined = member.status in JOINED
+    _members.set(user_id, joined, ttl=None if joined else Config.FS_NONMEMBER_TTL)
+    return joined
+
+async def is_member(client, user_id):
+    """Whether the user is in FS_CHANNEL_ID. Cached; concurrent checks for one user share a request."""
+    joined = _members.get(user_id)
+    if joined is not None:
+        return joined
+    fut = _inflight.get(user_id)
+    if fut is None:
+        fut = _inflight[user_id] = asyncio.ensure_future(_fetch(client, user_id))
+        fut.add_done_callback(lambda _: _inflight.pop(user_id, None))
+    return await asyncio.shield(fut)
+
+async def channel_url(client):
+    """Invite link of FS_CHANNEL_ID, looked up once."""
+    global _channel_url
+    if _channel_url:
+        return _channel_url
+    try:
+        chat = await client.get_chat(Config.FS_CHANNEL_ID)
+    except Exception:
+        return "https://t.me/{}".format(Config.FS_CHANNEL_ID)
+    _channel_url = f"https://t.me/{chat.username}" if chat.username else f"https://t.me/c/{str(Config.FS_CHANNEL_ID)[4:]}"
+    return _channel_url
+
+def update(event):
+    """Apply a chat_member_updated event from the channel so the cache never serves a stale answer."""
+    user = (event.new_chat_member or event.old_chat_member).user
+    if event.new_chat_member is None:
+        _members.set(user.id, False, ttl=Config.FS_NONMEMBER_TTL)
+    else:
+        joined = event.new_chat_member.status in JOINED
+        _members.set(user.id, joined, ttl=None if joined else Config.FS_NONMEMBER_TTL)
@@ -0,0 +1,149 @@
+import time
+import functools
+import logging
+from contextlib import asynccontextmanager
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+_registry = []
+
+def _fmt_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for key, v in self.values.items():
+            yield f"{self.name}{_fmt_labels(key)} {v}"
+
+class Gauge:
+    """Value read at scrape time from `fn`, which returns a number or {labels-tuple: number}."""
+
+    def __init__(self, name, help, fn):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        _registry.append(self)
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        if isinstance(value, dict):
+            for key, v in value.items():
+                yield f"{self.name}{_fmt_labels(key)} {v}"
+        else:
+            yield f"{self.name} {value}"
+
+class Histogram:
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = sorted(buckets)
+        self.series = {}   # labels -> [bucket counts..., sum, count]
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        s = self.series.get(key)
+        if s is None:
+            s = self.series[key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, b in enumerate(self.buckets):
+            if value <= b:
+                s[i] += 1
+        s[-2] += value
+        s[-1] += 1
+
+    def summary(self):
+        """{labels: (count, avg)} for the /stats command."""
+        return {key: (s[-1], s[-2] / s[-1] if s[-1] else 0.0) for key, s in self.series.items()}
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, s in self.series.items():
+            for b, n in zip(self.buckets, s):
+                yield f"{self.name}_bucket{_fmt_labels(key + (('le', b),))} {n}"
+            yield f"{self.name}_bucket{_fmt_labels(key + (('le', '+Inf'),))} {s[-1]}"
+            yield f"{self.name}_sum{_fmt_labels(key)} {s[-2]}"
+            yield f"{self.name}_count{_fmt_labels(key)} {s[-1]}"
+
+STAGE_SECONDS = Histogram(
+    "bot_stage_seconds", "Time spent per processing stage",
+    (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+STAGE_ERRORS = Counter("bot_stage_errors_total", "Stages that raised")
+BYTES = Counter("bot_bytes_total", "Bytes transferred")
+FLOODWAITS = Counter("bot_floodwait_total", "FloodWait errors received")
+FLOODWAIT_SECONDS = Counter("bot_floodwait_seconds_total", "Seconds Telegram asked us to wait")
+
+@asynccontextmanager
+async def timed(stage):
+    started = time.monotonic()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.monotonic() - started, stage=stage)
+
+def floodwait(source, seconds):
+    FLOODWAITS.inc(source=source)
+    FLOODWAIT_SECONDS.inc(seconds, source=source)
+
+def cache_gauge(name, caches):
+    """Expose hit/miss counters of several caches as one labelled gauge."""
+    def read():
+        out = {}
+        for cache_name, stats in caches.items():
+            s = stats()
+            out[(("cache", cache_name),)] = s[name]
+        return out
+    return read
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+async def _handle(request):
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+async def start_server(port, host="127.0.0.1"):
+    """Serve /metrics in Prometheus text format. Returns the runner (call .cleanup() to stop)."""
+    app = web.Application()
+    app.router.add_get("/metrics", _handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Metrics on http://%s:%s/metrics", host, port)
+    return runner
+
+def instrument(stage):
+    """Decorator form of timed() for handlers."""
+    def deco(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            async with timed(stage):
+                return await func(*args, **kwargs)
+        return wrapper
+    return deco
@@ -0,0 +1,203 @@
+import os
+import time
+import asyncio
+import logging
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from config import Config
+from cache import TTLCache
+from database import nsfw_verdicts
+
+logger = logging.getLogger(__name__)
+
+BAD_WORDS = ("porn","xxx","adult","nsfw")
+# previews being scanned; TMP_DIR sweeps leave this directory alone
+PREVIEW_DIR = os.path.join(os.path.abspath(Config.TMP_DIR), "nsfw")
+
+# ---- worker process side ----
+
+_classifier = None
+
+def _init_worker():
+    global _classifier
+    try:
+        from nudenet import NudeClassifier
+        _classifier = NudeClassifier()
+    except Exception:
+        _classifier = None
+
+def _model_loaded():
+    return _classifier is not None
+
+def _classify_batch(paths, threshold):
+    """Returns {path: True if safe, False if unsafe, None if unknown}."""
+    if _classifier is None:
+        return {p: None for p in paths}
+    out = {}
+    try:
+        res = _classifier.classify(paths, batch_size=len(paths))
+    except Exception:
+        # one unreadable preview fails the whole batch; classify the rest one by one
+        res = {}
+        for p in paths:
+            try:
+                res.update(_classifier.classify([p], batch_size=1))
+            except Exception:
+                pass
+    for p in paths:
+        r = res.get(p)
+        # nudenet returns dict path->{'safe':p, 'unsafe':q} or similar
+        if isinstance(r, dict):
+            out[p] = not (r.get("unsafe",0) > threshold or r.get("porn",0) > threshold)
+        else:
+            out[p] = None
+    return out
+
+# ---- event loop side ----
+
+class NSFWService:
+    """
+    Scans previews in a dedicated process. Requests from all users are
+    grouped into batches of up to `batch_size` collected for at most
+    `window` seconds, so the model runs once per batch.
+    """
+
+    def __init__(self, batch_size=8, window=0.2):
+        self.batch_size = batch_size
+        self.window = window
+        self._pool = None
+        self._queue = None
+        self._task = None
+        self.inflight = 0
+        self.scans = 0
+        self.scan_seconds = 0.0
+        self.last_latency = 0.0
+
+    def _ensure_started(self):
+        if self._task is None:
+            # forkserver: forking the threaded bot process can deadlock the child
+            self._pool = ProcessPoolExecutor(max_workers=1, initializer=_init_worker, mp_context=multiprocessing.get_context("forkserver"))
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def warmup(self):
+        """Start the worker process and load the model now rather than on the first scan. Returns seconds taken."""
+        self._ensure_started()
+        started = time.monotonic()
+        if not await asyncio.get_running_loop().run_in_executor(self._pool, _model_loaded):
+            logger.warning("NSFW model could not be loaded; only file names are checked")
+        return time.monotonic() - started
+
+    async def classify(self, path):
+        self._ensure_started()
+        fut = asyncio.get_running_loop().create_future()
+        started = time.monotonic()
+        await self._queue.put((path, fut))
+        try:
+            return await fut
+        finally:
+            self.last_latency = time.monotonic() - started
+            self.scans += 1
+            self.scan_seconds += self.last_latency
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self.inflight = len(batch)
+            try:
+                res = await loop.run_in_executor(self._pool, _classify_batch, [p for p, _ in batch], Config.NSFW_THRESHOLD)
+            except Exception:
+                logger.exception("NSFW worker failed")
+                res = {}
+            self.inflight = 0
+            for p, fut in batch:
+                if not fut.done():
+                    fut.set_result(res.get(p))
+
+    def stats(self):
+        return {
+            "queue_depth": (self._queue.qsize() if self._queue else 0) + self.inflight,
+            "scans": self.scans,
+            "avg_latency": round(self.scan_seconds / self.scans, 3) if self.scans else 0.0,
+            "last_latency": round(self.last_latency, 3),
+            "cache": cache_stats(),
+        }
+
+    def close(self):
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+service = NSFWService(Config.NSFW_BATCH_SIZE, Config.NSFW_BATCH_WINDOW)
+# file_unique_id -> safe verdict, backed by the nsfw_verdicts collection
+_verdicts = TTLCache(Config.NSFW_CACHE_SIZE, Config.NSFW_CACHE_TTL)
+# file_unique_id -> scan in progress, shared by concurrent checks of the same file
+_inflight = {}
+
+def cache_stats():
+    return _verdicts.stats()
+
+async def _cached_verdict(key):
+    v = _verdicts.get(key)
+    if v is None:
+        doc = await nsfw_verdicts.find_one({"_id": key})
+        if doc:
+            v = doc["safe"]
+            _verdicts.set(key, v)
+    return v
+
+async def _store_verdict(key, safe):
+    _verdicts.set(key, safe)
+    await nsfw_verdicts.update_one({"_id": key}, {"$set": {"safe": safe, "time": datetime.utcnow()}}, upsert=True)
+
+async def is_safe(client, file_msg):
+    if not Config.USE_NSFW:
+        return True
+    media = file_msg.document or file_msg.video or file_msg.audio or file_msg.photo
+    # Basic filename filter
+    fname = getattr(media, "file_name", None) or ""
+    if any(k in fname.lower() for k in BAD_WORDS):
+        return False
+    key = media.file_unique_id
+    verdict = await _cached_verdict(key)
+    if verdict is not None:
+        return verdict
+    # visual check for photos or thumbnails
+    preview_id = media.file_id if file_msg.photo else next(iter(getattr(media, "thumbs", None) or []), None)
+    if preview_id is None:
+        return True
+    if not isinstance(preview_id, str):
+        preview_id = preview_id.file_id
+    fut = _inflight.get(key)
+    if fut is None:
+        fut = _inflight[key] = asyncio.ensure_future(_scan(client, key, preview_id))
+        fut.add_done_callback(lambda _: _inflight.pop(key, None))
+    return await asyncio.shield(fut)
+
+# Download the preview and classify it; one scan per file however many checks wait on it
+async def _scan(client, key, preview_id):
+    os.makedirs(PREVIEW_DIR, exist_ok=True)
+    preview = os.path.join(PREVIEW_DIR, f"{key}.jpg")
+    try:
+        await client.download_media(preview_id, file_name=preview)
+        verdict = await service.classify(preview)
+    except Exception:
+        verdict = None
+    finally:
+        try: os.remove(preview)
+        except: pass
+    if verdict is None:
+        # classifier unavailable; don't remember an unknown result
+        return True
+    await _store_verdict(key, verdict)
+    return verdict
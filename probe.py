@@ -0,0 +1,137 @@
+import os
+import mmap
+import mimetypes
+import shutil
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_probes = TTLCache(Config.PROBE_CACHE_SIZE, Config.PROBE_CACHE_TTL)
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=Config.PROBE_WORKERS, thread_name_prefix="probe")
+    return _pool
+
+def cache_stats():
+    return _probes.stats()
+
+def _kind(mime):
+    mime = mime or ""
+    if mime.startswith("video/"):
+        return "video"
+    if mime.startswith("audio/"):
+        return "audio"
+    return None
+
+def kind_of(filename):
+    """"video", "audio" or None, judging by the file extension."""
+    return _kind(mimetypes.guess_type(filename)[0])
+
+def _hachoir():
+    # imported on the first probe: hachoir registers every parser at import, which costs startup time
+    import hachoir.core.config
+    from hachoir.stream import InputIOStream
+    from hachoir.parser import guessParser
+    from hachoir.metadata import extractMetadata
+    hachoir.core.config.quiet = True  # hachoir prints parse warnings to stdout otherwise
+    return InputIOStream, guessParser, extractMetadata
+
+def _probe_file(path):
+    """
+    Read container headers only. The file is mmapped, so hachoir faults in
+    just the pages it seeks to (headers, index atoms) instead of reading
+    the whole payload, and extraction runs at the lowest quality so it
+    stops after the header fields.
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        return {}
+    InputIOStream, guessParser, extractMetadata = _hachoir()
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        stream = InputIOStream(mm, size=size * 8, source=f"file:{path}", filename=os.path.basename(path))
+        parser = guessParser(stream)
+        if parser is None:
+            return {}
+        with parser:
+            meta = extractMetadata(parser, quality=0.0)
+            kind = _kind(getattr(parser, "mime_type", None) or "")
+            if meta is None:
+                return {"kind": kind} if kind else {}
+            info = {"kind": kind}
+            if meta.has("duration"):
+                info["duration"] = int(meta.get("duration").total_seconds())
+            for key in ("width", "height", "title", "author"):
+                if meta.has(key):
+                    info[key] = meta.get(key)
+            # audio-only containers sometimes carry a cover image size; drop it
+            if kind == "audio":
+                info.pop("width", None)
+                info.pop("height", None)
+            return info
+
+async def probe(path, key=None):
+    """
+    Returns {"kind": "video"|"audio"|None, "duration", "width", "height", ...}
+    for a local media file, probing in the thread pool. Results are cached
+    by `key` (the source file_unique_id) so re-renames of the same upload
+    skip the probe.
+    """
+    if key is not None:
+        info = _probes.get(key)
+        if info is not None:
+            return info
+    loop = asyncio.get_running_loop()
+    try:
+        info = await loop.run_in_executor(get_pool(), _probe_file, path)
+    except Exception as e:
+        logger.debug("probe failed for %s: %s", path, e)
+        info = {}
+    if key is not None:
+        _probes.set(key, info)
+    return info
+
+def from_media(media):
+    """Telegram already knows the attributes of videos and audio; use them when present."""
+    duration = getattr(media, "duration", None)
+    if not duration:
+        return None
+    info = {"duration": duration}
+    if getattr(media, "width", None):
+        info.update(kind="video", width=media.width, height=media.height)
+    else:
+        info.update(kind="audio", title=getattr(media, "title", None), author=getattr(media, "performer", None))
+    return info
+
+async def video_thumb(client, media, path, duration, dest):
+    """
+    Thumbnail for a video when the user has none: the Telegram preview if
+    the source has one, otherwise one frame of the local file at `path`
+    grabbed with ffmpeg (if it is installed). Returns the jpeg path or None.
+    """
+    thumbs = getattr(media, "thumbs", None)
+    if thumbs:
+        try:
+            return await client.download_media(thumbs[0].file_id, file_name=dest)
+        except Exception:
+            pass
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg or not path:
+        return None
+    proc = await asyncio.create_subprocess_exec(
+        ffmpeg, "-v", "error", "-y", "-ss", str(min((duration or 0) // 2, 5)), "-i", path,
+        "-frames:v", "1", "-vf", "scale=320:-2", dest,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+    )
+    await proc.wait()
+    return dest if proc.returncode == 0 and os.path.exists(dest) else None
+
+def close():
+    if _pool is not None:
+        _pool.shutdown(wait=False)
@@ -0,0 +1,124 @@
+import time
+import humanize
+from pyrogram.errors import FloodWait, MessageNotModified
+from config import Config
+from database import record_transfer
+from metrics import BYTES, floodwait
+
+# running totals per direction, for /stats and metrics
+totals = {
+    "download": {"count": 0, "bytes": 0, "seconds": 0.0},
+    "upload": {"count": 0, "bytes": 0, "seconds": 0.0},
+}
+
+def _bar(fraction, width=12):
+    filled = int(fraction * width)
+    return "█" * filled + "░" * (width - filled)
+
+class Progress:
+    """
+    Pyrogram progress callback for one transfer. Edits the job's status
+    message at most every `interval` seconds with speed and ETA, and
+    records the transfer's throughput when done() is called.
+    """
+
+    def __init__(self, status_msg, label, direction, user_id=None, interval=None):
+        self.status_msg = status_msg
+        self.label = label
+        self.direction = direction
+        self.user_id = user_id
+        self.interval = Config.PROGRESS_INTERVAL if interval is None else interval
+        self.started = time.monotonic()
+        self.current = 0
+        self.total = 0
+        self._next_edit = 0.0
+
+    def speed(self):
+        elapsed = time.monotonic() - self.started
+        return self.current / elapsed if elapsed > 0 else 0.0
+
+    def text(self):
+        fraction = self.current / self.total if self.total else 0.0
+        speed = self.speed()
+        eta = (self.total - self.current) / speed if speed > 0 else 0
+        return (
+            f"{self.label}\n"
+            f"{_bar(fraction)} {fraction*100:.1f}%\n"
+            f"{humanize.naturalsize(self.current, binary=True)} / {humanize.naturalsize(self.total, binary=True)}\n"
+            f"⚡ {humanize.naturalsize(speed, binary=True)}/s · ETA {humanize.precisedelta(eta, minimum_unit='seconds', format='%0.0f')}"
+        )
+
+    async def update(self, current, total):
+        self.current, self.total = current, total
+        now = time.monotonic()
+        if now < self._next_edit or not self.status_msg:
+            return
+        self._next_edit = now + self.interval
+        try:
+            await self.status_msg.edit(self.text())
+        except FloodWait as e:
+            floodwait("progress_edit", e.value)
+            self._next_edit = now + e.value
+        except MessageNotModified:
+            pass
+        except Exception:
+            pass
+
+    async def done(self):
+        seconds = time.monotonic() - self.started
+        t = totals[self.direction]
+        t["count"] += 1
+        t["bytes"] += self.total
+        t["seconds"] += seconds
+        BYTES.inc(self.total, direction=self.direction)
+        await record_transfer({
+            "user": self.user_id,
+            "direction": self.direction,
+            "bytes": self.total,
+            "seconds": round(seconds, 3),
+            "bps": round(self.total / seconds) if seconds > 0 else None,
+        })
+
+class BatchProgress(Progress):
+    """
+    One status message for a whole batch. `current`/`total` count the bytes
+    downloaded plus uploaded over all files; each file's transfers get their
+    own part() so they are still recorded like single transfers.
+    """
+
+    def __init__(self, status_msg, count, total_bytes, user_id=None, interval=None):
+        super().__init__(status_msg, "", "batch", user_id, interval)
+        self.count = count
+        self.total = 2 * total_bytes
+        self.sent = 0
+        self.failed = 0
+        self._parts = {}
+
+    def part(self, index, direction):
+        return _BatchPart(self, (index, direction), direction)
+
+    async def _part_update(self, key, current):
+        self._parts[key] = current
+        await self.update(sum(self._parts.values()), self.total)
+
+    def text(self):
+        self.label = f"📦 Batch: {self.sent}/{self.count} sent" + (f", {self.failed} failed" if self.failed else "")
+        return super().text()
+
+    async def done(self):
+        # the parts already recorded every transfer
+        pass
+
+class _BatchPart(Progress):
+    def __init__(self, batch, key, direction):
+        super().__init__(None, "", direction, batch.user_id)
+        self.batch = batch
+        self.key = key
+
+    async def update(self, current, total):
+        self.current, self.total = current, total
+        await self.batch._part_update(self.key, current)
+
+def throughput():
+    """Average bytes/sec per direction since start."""
+    return {d: (t["bytes"] / t["seconds"] if t["seconds"] else 0.0) for d, t in totals.items()}
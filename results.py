@@ -0,0 +1,62 @@
+import logging
+from datetime import datetime
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure
+from config import Config
+from database import job_results as results
+
+logger = logging.getLogger(__name__)
+
+hits = 0
+misses = 0
+
+def params_for(op):
+    """Settings that change the output of an operation and therefore belong in the key."""
+    if op == "split":
+        return {"split_mb": Config.SPLIT_SIZE_MB}
+    if op == "compress":
+        return {"max_mb": Config.MAX_UPLOAD_MB, "split_mb": Config.SPLIT_SIZE_MB}
+    return {}
+
+def _key(file_unique_id, op):
+    params = params_for(op)
+    return ":".join([file_unique_id, op] + [f"{k}={params[k]}" for k in sorted(params)])
+
+async def lookup(file_unique_id, op):
+    """Returns the stored outputs [{file_id, caption}, ...] for this file and op, or None."""
+    global hits, misses
+    doc = await results.find_one_and_update(
+        {"_id": _key(file_unique_id, op)},
+        {"$set": {"last_used": datetime.utcnow()}, "$inc": {"hits": 1}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if doc:
+        hits += 1
+        return doc["docs"]
+    misses += 1
+    return None
+
+async def save(file_unique_id, op, sent):
+    """Store the outputs of a job; `sent` holds its {file_id, caption, ...} entries in order."""
+    docs = [{"file_id": e["file_id"], "caption": e["caption"]} for e in sent if e.get("file_id")]
+    if not docs or len(docs) != len(sent):
+        return
+    now = datetime.utcnow()
+    await results.update_one({"_id": _key(file_unique_id, op)}, {
+        "$set": {"op": op, "file_unique_id": file_unique_id, "params": params_for(op), "docs": docs, "last_used": now},
+        "$setOnInsert": {"created": now, "hits": 0},
+    }, upsert=True)
+
+async def forget(file_unique_id, op):
+    await results.delete_one({"_id": _key(file_unique_id, op)})
+
+async def ensure_indexes():
+    # entries not reused for RESULT_TTL_DAYS are evicted by Mongo
+    try:
+        await results.create_index("last_used", expireAfterSeconds=Config.RESULT_TTL_DAYS * 86400)
+    except OperationFailure:
+        logger.warning("results.last_used index exists with other options; drop it to change RESULT_TTL_DAYS")
+
+def stats():
+    total = hits + misses
+    return {"hits": hits, "misses": misses, "hit_rate": round(hits / total, 4) if total else 0.0}
@@ -0,0 +1,103 @@
+import time
+import logging
+import aiohttp
+from config import Config
+from cache import TTLCache
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+_session = None
+# long url -> short url
+_cache = TTLCache(Config.SHORTENER_CACHE_SIZE, Config.SHORTENER_CACHE_TTL)
+
+class CircuitBreaker:
+    """
+    After `threshold` consecutive failures the breaker opens and calls are
+    skipped for `reset_after` seconds; then one trial call is let through.
+    """
+
+    def __init__(self, threshold=3, reset_after=60):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at >= self.reset_after:
+            # half-open: let one call probe the API
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            if self.opened_at is None:
+                logger.warning("Shortener failing, falling back to raw links for %ss", self.reset_after)
+            self.opened_at = time.monotonic()
+
+breaker = CircuitBreaker(Config.SHORTENER_FAILURES, Config.SHORTENER_COOLDOWN)
+
+def _get_session():
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=Config.SHORTENER_TIMEOUT),
+            connector=aiohttp.TCPConnector(limit=Config.SHORTENER_POOL),
+        )
+    return _session
+
+def _parse(data):
+    # Try common fields
+    for key in ("short","shortenedUrl","short_url","result","url"):
+        if isinstance(data, dict) and key in data:
+            return data[key]
+    # if API returns direct string
+    if isinstance(data, str) and data.startswith("http"):
+        return data
+    return None
+
+async def shorten(full_url: str) -> str:
+    """
+    Uses your custom shortener API.
+    Expects Config.SHORTENER_URL to accept (api, url) (common pattern).
+    If your API differs, adapt the payload below.
+    Returns shortened URL on success, otherwise original URL.
+    """
+    short = _cache.get(full_url)
+    if short:
+        return short
+    if not Config.SHORTENER_API or not breaker.allow():
+        return full_url
+    try:
+        payload = {
+            "api": Config.SHORTENER_API,
+            "url": full_url
+        }
+        # If your API expects POST JSON, change to session.post(Config.SHORTENER_URL, json=payload)
+        async with timed("shortener"), _get_session().get(Config.SHORTENER_URL, params=payload) as r:
+            r.raise_for_status()
+            data = await r.json(content_type=None)
+        short = _parse(data)
+    except Exception:
+        short = None
+    if not short:
+        breaker.failure()
+        return full_url
+    breaker.success()
+    _cache.set(full_url, short)
+    return short
+
+def cache_stats():
+    return _cache.stats()
+
+async def close():
+    if _session is not None and not _session.closed:
+        await _session.close()
@@ -0,0 +1,147 @@
+import os
+import shutil
+import asyncio
+import logging
+from helper import remove_files
+
+logger = logging.getLogger(__name__)
+
+class SpaceError(Exception):
+    pass
+
+class Reservation:
+    """Bytes set aside in TMP_DIR for one job plus every file the job creates there."""
+
+    def __init__(self, space, key, nbytes):
+        self.space = space
+        self.key = key
+        self.nbytes = nbytes
+        self.dir = space.dir_for(key)
+        self.files = []
+
+    def track(self, path):
+        self.files.append(path)
+        return path
+
+    def path(self, name):
+        """A tracked path for `name` inside this job's own directory."""
+        os.makedirs(self.dir, exist_ok=True)
+        return self.track(os.path.join(self.dir, name))
+
+    def written(self):
+        total = 0
+        for p in self.files:
+            try:
+                total += os.path.getsize(p)
+            except OSError:
+                pass
+        return total
+
+    async def release(self, keep_files=False):
+        """Give the space back; `keep_files` leaves the files for a later run of the same job to resume from."""
+        if not keep_files:
+            await remove_files(self.files)
+            shutil.rmtree(self.dir, ignore_errors=True)
+        self.files = []
+        await self.space._release(self)
+
+class TempSpace:
+    """
+    Admission control for TMP_DIR. Jobs reserve their expected footprint
+    before downloading; if it does not fit they wait in line (FIFO) until
+    running jobs release space, or are rejected when they could never fit.
+    """
+
+    def __init__(self, root, budget_bytes=0, min_free_bytes=0):
+        # absolute: pyrogram puts relative download paths under the script's folder, not the cwd
+        self.root = os.path.abspath(root)
+        self.budget = budget_bytes
+        self.min_free = min_free_bytes
+        self._active = {}
+        self._waiters = []
+        self._cond = None
+
+    def dir_for(self, key):
+        """Directory of a job's files; stable across restarts so an unfinished job finds them again."""
+        return os.path.join(self.root, "_".join(str(k) for k in key) if isinstance(key, tuple) else str(key))
+
+    def reserved(self):
+        return sum(r.nbytes for r in self._active.values())
+
+    def _free_disk(self):
+        try:
+            return shutil.disk_usage(self.root).free - self.min_free
+        except OSError:
+            return 0
+
+    def capacity(self):
+        # space the active jobs already wrote is no longer in disk_usage().free
+        cap = self._free_disk() + sum(r.written() for r in self._active.values())
+        return min(cap, self.budget) if self.budget else cap
+
+    def _fits(self, nbytes):
+        return self.reserved() + nbytes <= self.capacity()
+
+    async def reserve(self, key, nbytes, timeout=None):
+        """Waits until `nbytes` fit. Raises SpaceError if they never can or `timeout` runs out."""
+        if nbytes == 0:
+            # nothing to admit (e.g. a streamed rename): never queue behind jobs waiting for space
+            res = self._active[key] = Reservation(self, key, 0)
+            return res
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        if nbytes > self.capacity():
+            raise SpaceError(f"needs {nbytes} bytes, only {self.capacity()} available")
+        async with self._cond:
+            self._waiters.append(key)
+            try:
+                await asyncio.wait_for(
+                    self._cond.wait_for(lambda: self._waiters[0] == key and self._fits(nbytes)),
+                    timeout,
+                )
+            except asyncio.TimeoutError:
+                raise SpaceError("timed out waiting for temp space")
+            finally:
+                self._waiters.remove(key)
+                self._cond.notify_all()
+            res = self._active[key] = Reservation(self, key, nbytes)
+            return res
+
+    def would_wait(self, nbytes):
+        return nbytes > 0 and (bool(self._waiters) or not self._fits(nbytes))
+
+    async def _release(self, res):
+        self._active.pop(res.key, None)
+        if self._cond is not None:
+            async with self._cond:
+                self._cond.notify_all()
+
+    def sweep(self, keep=()):
+        """Delete files left in TMP_DIR by a crash. Call before any job starts."""
+        keep = {os.path.abspath(p) for p in keep}
+        removed = freed = 0
+        for entry in os.scandir(self.root):
+            path = os.path.abspath(entry.path)
+            if path in keep:
+                continue
+            try:
+                size = entry.stat().st_size
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+                removed += 1
+                freed += size
+            except OSError:
+                logger.warning("Could not remove orphan %s", path)
+        if removed:
+            logger.info("Swept %d orphaned temp files (%d bytes)", removed, freed)
+        return removed, freed
+
+    def stats(self):
+        return {
+            "active_jobs": len(self._active),
+            "waiting_jobs": len(self._waiters),
+            "reserved_bytes": self.reserved(),
+            "capacity_bytes": self.capacity(),
+        }
@@ -0,0 +1,241 @@
+import os
+import asyncio
+import logging
+from hashlib import md5
+from math import ceil
+from pyrogram import raw, types, utils
+from pyrogram.errors import FloodWait
+from pyrogram.session import Session
+from config import Config
+from metrics import floodwait
+
+logger = logging.getLogger(__name__)
+
+CHUNK = 1024 * 1024   # stream_media yields 1 MiB chunks
+PART = 512 * 1024     # upload part size Telegram accepts
+BIG_FILE = 10 * 1024 * 1024  # larger uploads use SaveBigFilePart
+
+class Pacer:
+    """
+    Adaptive spacing between Telegram calls: starts with no delay, waits
+    out a FloodWait and keeps a gap afterwards that shrinks as calls succeed.
+    """
+
+    def __init__(self, max_gap=5.0):
+        self.gap = 0.0
+        self.max_gap = max_gap
+
+    async def call(self, fn, *args, **kwargs):
+        while True:
+            if self.gap:
+                await asyncio.sleep(self.gap)
+            try:
+                res = await fn(*args, **kwargs)
+            except FloodWait as e:
+                floodwait("transfer", e.value)
+                self.gap = min(self.max_gap, max(self.gap * 2, 0.5))
+                await asyncio.sleep(e.value)
+                continue
+            self.gap = self.gap / 2 if self.gap > 0.05 else 0.0
+            return res
+
+async def _stream_chunks(client, message, first, count):
+    """
+    Yield (index, data) for chunks [first, first+count) of `message`'s media.
+    get_file logs and swallows its own errors (FloodWait included) and just
+    ends the stream, so a stream that ends early is resumed with backoff;
+    STREAM_RETRIES such passes in a row without a chunk raise IOError.
+    """
+    chunk = first
+    end = first + count
+    fails = 0
+    while True:
+        async for data in client.stream_media(message, offset=chunk, limit=end - chunk):
+            yield chunk, data
+            chunk += 1
+            fails = 0
+        if chunk >= end:
+            return
+        fails += 1
+        if fails > Config.STREAM_RETRIES:
+            raise IOError(f"download of message {message.id} stopped at chunk {chunk} of {end}")
+        logger.warning("Stream of message %s ended at chunk %d of %d, retrying", message.id, chunk, end)
+        await asyncio.sleep(min(2 ** fails, 30))
+
+async def _download_range(client, message, fd, first, count, size, done, progress):
+    """Stream chunks [first, first+count) into fd at their offsets."""
+    async for chunk, data in _stream_chunks(client, message, first, count):
+        os.pwrite(fd, data, chunk * CHUNK)
+        done[0] += len(data)
+        if progress:
+            await progress(done[0], size)
+
+async def download(client, message, path, size, progress=None):
+    """
+    Download `message`'s media to `path`. Files of PARALLEL_MIN_MB or more are
+    fetched as DOWNLOAD_CONNECTIONS concurrent ranges written into a
+    preallocated file; smaller ones use a plain download_media.
+    """
+    if not size or size < Config.PARALLEL_MIN_MB * 1024 * 1024 or Config.DOWNLOAD_CONNECTIONS < 2:
+        got = await client.download_media(message, file_name=path, progress=progress)
+        # get_file swallows its errors and just ends the stream, so a short file is a failed download
+        if size and (not got or os.path.getsize(got) != size):
+            raise IOError(f"download of message {message.id} is incomplete")
+        return got
+    chunks = ceil(size / CHUNK)
+    per_conn = ceil(chunks / Config.DOWNLOAD_CONNECTIONS)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        if hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(fd, 0, size)
+        else:
+            os.ftruncate(fd, size)
+        done = [0]
+        ranges = [asyncio.create_task(_download_range(client, message, fd, first, min(per_conn, chunks - first), size, done, progress))
+                  for first in range(0, chunks, per_conn)]
+        try:
+            await asyncio.gather(*ranges)
+        finally:
+            # one failed range fails the download; stop the others before the fd closes
+            for t in ranges:
+                t.cancel()
+            await asyncio.gather(*ranges, return_exceptions=True)
+    finally:
+        os.close(fd)
+    return path
+
+async def _upload_session(client):
+    """A media session of its own for raw part uploads, as save_file opens."""
+    session = Session(client, await client.storage.dc_id(), await client.storage.auth_key(),
+                      await client.storage.test_mode(), is_media=True)
+    await session.start()
+    return session
+
+async def stream_upload(client, message, size, file_name, progress=None):
+    """
+    Upload `message`'s media again while it downloads, without touching the
+    disk: stream_media chunks are cut into upload parts that wait in a queue
+    of at most STREAM_BUFFER_MB until one of STREAM_UPLOAD_WORKERS saves them.
+    `size` must be the exact file size. Returns the InputFile to send.
+    """
+    total_parts = ceil(size / PART)
+    big = size > BIG_FILE
+    file_id = client.rnd_id()
+    digest = None if big else md5()
+    parts = asyncio.Queue(max(1, Config.STREAM_BUFFER_MB * 1024 * 1024 // PART))
+    workers = max(1, Config.STREAM_UPLOAD_WORKERS)
+    done = [0]
+    session = await _upload_session(client)
+    pacer = Pacer()
+
+    async def fetch():
+        # raises IOError if the stream keeps ending early, which cancels the uploaders too
+        async for chunk, data in _stream_chunks(client, message, 0, ceil(size / CHUNK)):
+            for pos in range(0, len(data), PART):
+                piece = data[pos:pos + PART]
+                if digest:
+                    digest.update(piece)
+                await parts.put(((chunk * CHUNK + pos) // PART, piece))
+        for _ in range(workers):
+            await parts.put(None)
+
+    async def save():
+        while (item := await parts.get()) is not None:
+            n, piece = item
+            if big:
+                rpc = raw.functions.upload.SaveBigFilePart(file_id=file_id, file_part=n, file_total_parts=total_parts, bytes=piece)
+            else:
+                rpc = raw.functions.upload.SaveFilePart(file_id=file_id, file_part=n, bytes=piece)
+            await pacer.call(session.invoke, rpc)
+            done[0] += len(piece)
+            if progress:
+                await progress(done[0], size)
+
+    tasks = [asyncio.create_task(fetch())] + [asyncio.create_task(save()) for _ in range(workers)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for t in tasks:
+            t.cancel()
+        await session.stop()
+    if big:
+        return raw.types.InputFileBig(id=file_id, parts=total_parts, name=file_name)
+    return raw.types.InputFile(id=file_id, parts=total_parts, name=file_name, md5_checksum=digest.hexdigest())
+
+async def _send_uploaded(client, chat_id, input_file, file_name, caption=None, attributes=(), thumb=None):
+    """
+    Send an already uploaded file (what send_document does after save_file).
+    `attributes` adds e.g. DocumentAttributeVideo; `thumb` is a local jpeg.
+    """
+    media = raw.types.InputMediaUploadedDocument(
+        mime_type=client.guess_mime_type(file_name) or "application/zip",
+        file=input_file,
+        thumb=await client.save_file(thumb) if thumb else None,
+        attributes=[raw.types.DocumentAttributeFilename(file_name=file_name), *attributes],
+    )
+    r = await client.invoke(raw.functions.messages.SendMedia(
+        peer=await client.resolve_peer(chat_id),
+        media=media,
+        random_id=client.rnd_id(),
+        **await utils.parse_text_entities(client, caption, None, None)
+    ))
+    for i in r.updates:
+        if isinstance(i, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage)):
+            return await types.Message._parse(client, i.message, {u.id: u for u in r.users}, {c.id: c for c in r.chats})
+
+async def send_file(client, chat_id, input_file, file_name, caption=None, info=None, thumb=None):
+    """Send an uploaded file under `file_name`; a probe `info` of kind video/audio sends it as such."""
+    attributes = []
+    if info and info.get("kind") == "video":
+        attributes.append(raw.types.DocumentAttributeVideo(duration=info.get("duration") or 0, w=info.get("width") or 0,
+                                                           h=info.get("height") or 0, supports_streaming=True))
+    elif info and info.get("kind") == "audio":
+        attributes.append(raw.types.DocumentAttributeAudio(duration=info.get("duration") or 0, title=info.get("title"),
+                                                           performer=info.get("author")))
+    return await Pacer().call(_send_uploaded, client, chat_id, input_file, file_name, caption, attributes, thumb)
+
+async def send_parts(client, chat_id, parts, captions, progress=None, on_sent=None):
+    """
+    Upload `parts` (paths or file objects) with up to UPLOAD_CONCURRENCY in
+    flight, but post them to the chat strictly in order. `on_sent(i, message)`
+    is awaited after each part is posted. Returns the sent messages.
+    """
+    sizes = []
+    for p in parts:
+        if isinstance(p, str):
+            sizes.append(os.path.getsize(p))
+        else:
+            p.seek(0, os.SEEK_END)
+            sizes.append(p.tell())
+            p.seek(0)
+    total = sum(sizes)
+    current = [0] * len(parts)
+    sem = asyncio.Semaphore(Config.UPLOAD_CONCURRENCY)
+    pacer = Pacer()
+
+    async def part_progress(cur, _, i):
+        current[i] = cur
+        if progress:
+            await progress(sum(current), total)
+
+    async def upload(i):
+        async with sem:
+            # save_file handles FloodWait itself (and returns None on any error); the pacer only spaces SendMedia
+            return await client.save_file(parts[i], progress=part_progress, progress_args=(i,))
+
+    uploads = [asyncio.create_task(upload(i)) for i in range(len(parts))]
+    sent = []
+    try:
+        for i, task in enumerate(uploads):
+            input_file = await task
+            if input_file is None:
+                # save_file logs and swallows its own errors
+                raise RuntimeError(f"upload of part {i+1} failed")
+            name = parts[i] if isinstance(parts[i], str) else parts[i].name
+            sent.append(await pacer.call(_send_uploaded, client, chat_id, input_file, os.path.basename(name), captions[i]))
+            if on_sent:
+                await on_sent(i, sent[-1])
+    finally:
+        for task in uploads:
+            task.cancel()
+    return sent
@@ -0,0 +1,166 @@
+"""
+Job worker: claims queued rename/compress/split jobs from the `jobs`
+collection and runs them. Start any number of these on any host that can
+reach Mongo and Telegram (each with its own TMP_DIR):
+
+    python worker.py
+
+The bot process also runs one embedded worker unless EMBEDDED_WORKER=false.
+"""
+import os
+import re
+import socket
+import asyncio
+import logging
+from pyrogram import Client, idle
+from config import Config
+from database import ensure_indexes, refund_quota, close_db
+from shortener import close as close_shortener
+import jobqueue
+import jobs
+import nsfw
+import probe
+import metrics
+
+logger = logging.getLogger(__name__)
+
+def worker_name():
+    """Stable name of this worker: WORKER_ID, else the host name."""
+    return Config.WORKER_ID or socket.gethostname()
+
+class Worker:
+    """
+    Runs up to `slots` jobs at once. Each running job's lease is renewed
+    every JOB_HEARTBEAT seconds; a user cancel flagged on the document, or
+    losing the lease, stops it. Also requeues jobs of workers that died.
+    """
+
+    def __init__(self, client, slots=None, name=None):
+        self.client = client
+        self.slots = slots or Config.JOB_WORKERS
+        # `name` finds this worker's files again after a restart; `id` owns leases and is
+        # unique per process, so the bot's embedded worker and a worker.py on the same host never collide
+        self.name = name or worker_name()
+        self.id = f"{self.name}:{os.getpid()}"
+        self._tasks = []
+        self._running = {}
+
+    async def start(self):
+        # jobs a crashed run of this worker left on its disk go back to the queue once their lease lapsed
+        await jobqueue.requeue_worker(self.name)
+        # anything else in TMP_DIR is from a crash; keep what unfinished jobs can resume from
+        keep = [jobs.tmp_space.dir_for(key) for key in await jobqueue.resumable()]
+        jobs.tmp_space.sweep(keep=[Config.THUMB_DIR, nsfw.PREVIEW_DIR] + keep)
+        self._tasks = [asyncio.create_task(self._slot()) for _ in range(self.slots)]
+        self._tasks.append(asyncio.create_task(self._reaper()))
+        logger.info("Worker %s started with %d slots", self.id, self.slots)
+
+    async def stop(self):
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def running(self):
+        return len(self._running)
+
+    async def _slot(self):
+        while True:
+            try:
+                doc = await jobqueue.claim(self.id)
+            except Exception:
+                logger.exception("Claiming a job failed")
+                doc = None
+            if doc is None:
+                await jobqueue.wait(Config.JOB_POLL)
+                continue
+            await self._run(jobs.Job(doc))
+
+    async def _run(self, job):
+        job.worker_id = self.id
+        job.worker_name = self.name
+        task = asyncio.create_task(jobs.run_job(self.client, job))
+        beat = asyncio.create_task(self._heartbeat(job, task))
+        self._running[job.key] = job
+        try:
+            status, fields = await task
+        except asyncio.CancelledError:
+            if job.lost:
+                return
+            if not job.cancelled:
+                # this worker is shutting down: let the job resume later, here or elsewhere
+                job.released = True
+                await asyncio.shield(jobqueue.release(job.id, self.id))
+                raise
+            logger.info("Job %s cancelled", job.key)
+            status, fields = "cancelled", {}
+        except Exception as e:
+            logger.exception("Job %s crashed", job.key)
+            status, fields = "failed", {"error": repr(e)}
+        finally:
+            beat.cancel()
+            self._running.pop(job.key, None)
+            if job.space:
+                await job.space.release(keep_files=job.released)
+        await jobqueue.finish(job.id, self.id, status, **fields)
+
+    async def _heartbeat(self, job, task):
+        while True:
+            await asyncio.sleep(Config.JOB_HEARTBEAT)
+            try:
+                doc = await jobqueue.heartbeat(job.id, self.id)
+            except Exception:
+                logger.warning("Heartbeat for job %s failed", job.key)
+                continue
+            if doc is None:
+                logger.warning("Job %s was taken over by another worker", job.key)
+                job.lost = True
+                task.cancel()
+                return
+            if doc.get("cancel_requested"):
+                job.cancelled = True
+                task.cancel()
+                return
+
+    async def _reaper(self):
+        while True:
+            try:
+                for doc in await jobqueue.requeue_expired():
+                    await refund_quota(doc["user_id"], doc.get("quota", 1))
+                    text = "❌ Cancelled." if doc["status"] == "cancelled" else "❌ Operation failed. It was not counted against your daily limit."
+                    try:
+                        await self.client.send_message(doc["payload"]["chat_id"], text)
+                    except Exception:
+                        pass
+                await jobqueue.refresh_counts()
+            except Exception:
+                logger.exception("Requeueing expired jobs failed")
+            await asyncio.sleep(Config.JOB_LEASE / 2)
+
+async def main():
+    # one session file per worker, so workers sharing a host do not share it
+    client = Client("rename_worker_" + re.sub(r"[^\w.-]", "_", worker_name()),
+                    api_id=Config.API_ID,
+                    api_hash=Config.API_HASH,
+                    bot_token=Config.BOT_TOKEN,
+                    max_concurrent_transmissions=Config.MAX_TRANSMISSIONS,
+                    no_updates=True)  # the bot process handles updates; this one only runs jobs
+    os.makedirs(Config.TMP_DIR, exist_ok=True)
+    await ensure_indexes()
+    await jobqueue.ensure_indexes()
+    metrics_runner = await metrics.start_server(Config.WORKER_METRICS_PORT, Config.METRICS_HOST) if Config.WORKER_METRICS_PORT else None
+    await client.start()
+    worker = Worker(client)
+    await worker.start()
+    await idle()
+    await worker.stop()
+    await client.stop()
+    if metrics_runner:
+        await metrics_runner.cleanup()
+    await close_db()
+    await close_shortener()
+    probe.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())